@@ -5,25 +5,129 @@ and baseline system models.
 Authors: Sena Katako, Vivian Gao, Xianyi Han
 """
 import preprocess
-import bigram
+import parallel
 import numpy as np
 
 TAGS = {'O': 0, 'PER': 1, 'LOC': 2, 'ORG': 3, 'MISC': 4}
 IDX2TAGS = ['O', 'PER', 'LOC', 'ORG', 'MISC']
+UNK = preprocess.UNK
+START = preprocess.START
+
+BATCH_SIZE = 256
 
 F1 = "train.txt"
-F2 = "trainNE.txt"
 
 class HMM:
 
-    def __init__(self, train, trainNE):
+    def __init__(self, train):
 
-        self._bigramNE = bigram.BigramLM(trainNE)
-        self._lexicon, self._vocab = preprocess.tagDictHMM(train)
+        wordIdx, counts, self._transCounts = preprocess.countsHMM(
+        preprocess.iterRecords(train))
 
         #Handling Unknown words for Lexicon
-        self._unknowns = assignUnk(self._vocab)
-        addUnknown(self._lexicon, self._unknowns)
+        self._wordIdx, self._emitCounts = assignUnk(wordIdx, counts)
+        self.makeTables()
+
+
+    def save(self, path):
+        """
+        a function that writes the trained model (vocabulary, emission
+        and transition counts) to a .npz file at exactly [path] (no
+        extension is added), so that [load] reads it back from [path].
+        """
+        with open(path, 'wb') as f:
+            np.savez(f, words = preprocess.packStrings(self._wordIdx),
+            counts = self._emitCounts, transCounts = self._transCounts)
+
+
+    @classmethod
+    def load(cls, path):
+        """
+        a function that returns a HMM model restored from a file written
+        by [save], without reading any training data.
+        """
+        model = cls.__new__(cls)
+        with np.load(path) as data:
+            words = preprocess.unpackStrings(data['words'])
+            model._emitCounts = data['counts']
+            model._transCounts = data['transCounts']
+
+        model._wordIdx = {word: i for i, word in enumerate(words)}
+        model.makeTables()
+        return model
+
+
+    def partial_fit(self, records):
+        """
+        a function that folds new labelled records (a path or records,
+        see [preprocess.iterRecords]) into the counts of the model. Only
+        the emission rows of the words in [records] are marked dirty;
+        they and the tag tables are refreshed before the next decoding.
+        Unlike a full retrain, words that were merged into UNK (see
+        [assignUnk]) get their own row when they reappear, and their
+        earlier counts stay in the UNK row, so the tags can differ
+        slightly from those of a model trained on all the records.
+        """
+        oldSize = len(self._emitCounts)
+        self._wordIdx, counts, transCounts = preprocess.countsHMM(
+        preprocess.iterRecords(records), self._wordIdx)
+
+        #Rows touched by the new records, before the old counts are added
+        touched = np.union1d(counts[:oldSize].any(axis = 1).nonzero()[0],
+        np.arange(oldSize, len(counts)))
+
+        counts[:oldSize] += self._emitCounts
+        self._emitCounts = counts
+        self._transCounts = self._transCounts + transCounts
+
+        if self._dirtyRows is not None:
+            touched = np.union1d(self._dirtyRows, touched)
+        self._dirtyRows = touched
+
+
+    def makeTables(self):
+        """
+        a function that builds the (vocab x 5) table of log emission
+        counts and the tag tables from the model's counts.
+        """
+        self._unkId = self._wordIdx[UNK]
+        with np.errstate(divide = 'ignore'):
+            self._logCounts = np.log(self._emitCounts)
+        self._dirtyRows = None
+        self.makeTagTables()
+
+
+    def refreshTables(self):
+        """
+        a function that recomputes the dirty rows of the log emission
+        counts and the tag tables after [partial_fit].
+        """
+        rows = self._dirtyRows
+        if rows is None:
+            return
+
+        grown = len(self._emitCounts) - len(self._logCounts)
+        if grown > 0:
+            self._logCounts = np.vstack([self._logCounts, np.zeros((grown, 5))])
+        with np.errstate(divide = 'ignore'):
+            self._logCounts[rows] = np.log(self._emitCounts[rows])
+        self._dirtyRows = None
+        self.makeTagTables()
+
+
+    def makeTagTables(self):
+        """
+        a function that builds the log tag counts (the emission
+        denominators), the log start vector and the 5x5 log transition
+        matrix (indexed [preTag, tag]) from the model's counts.
+        """
+        tagCounts = np.maximum(self._emitCounts.sum(axis = 0), 1)
+        starts = max(self._transCounts[START].sum(), 1)
+
+        with np.errstate(divide = 'ignore'):
+            self._logTagCounts = np.log(tagCounts)
+            self._logStart = np.log(self._transCounts[START] / starts)
+            self._logTrans = np.log(self._transCounts[:START] / tagCounts[:, None])
 
 
     def assignTags(self, sentence):
@@ -31,56 +135,81 @@ class HMM:
         a function that assigns tags to a given sentence (as a string)
         and returns the assigned tags as a list.
         """
+        self.refreshTables()
         tokens = sentence.strip().split()
-        length = len(tokens)
+        logEmit = self.getLogEmit(tokens)
 
-        matProb = np.zeros((5, length))             #matrix for the probability
-        matBP = np.zeros(5, str(length) + 'int8')   #matrix for the backpointers
-        self.matInit(tokens[0], matProb)
+        matProb, matBP = viterbi(self._logStart, self._logTrans, logEmit)
+        return getPath(matProb, matBP)
+
+
+    def assignTagsBatch(self, sentences):
+        """
+        a function that assigns tags to a batch of sentences (as strings)
+        in one padded viterbi pass and returns a list of tag lists.
+        """
+        return self.decodeBatch([sentence.strip().split()
+        for sentence in sentences])
 
-        for i in range(1, length):
-            token = tokens[i]
-            prevProb = matProb[:, i-1]
 
-            for tag, idx in TAGS.items():
-                tempPrev = prevProb.copy()
+    def decodeBatch(self, tokenLists):
+        """
+        a function that assigns tags to a batch of sentences given as
+        lists of tokens.
+        """
+        self.refreshTables()
+        lengths = np.array([len(tokens) for tokens in tokenLists])
+        maxLen = max(lengths.max(initial = 0), 1)
 
-                #Multiplies transition probabilities
-                for preTag, j in TAGS.items():
-                    transProb = self.getTransProb(preTag, tag)
-                    tempPrev[j] = tempPrev[j] * transProb
+        #Padded (batch, max_len, 5) tensor of log emissions
+        logEmit = np.zeros((len(tokenLists), maxLen, 5))
+        for b, tokens in enumerate(tokenLists):
+            if tokens:
+                logEmit[b, :len(tokens)] = self.getLogEmit(tokens).T
 
-                #Fill in the two matrixes
-                lexProb = self.getLexProb(token, tag)
-                matProb[idx, i] = tempPrev.max() * lexProb
-                matBP[idx, i] = tempPrev.argmax()
+        #Transition scores shared by the batch, the emissions are added
+        #after each max
+        scores = np.empty((1, maxLen, 5, 5))
+        scores[:, 0, 0] = self._logStart
+        scores[:, 1:] = self._logTrans
 
-        return getPath(matProb, matBP)
+        paths = viterbiBatch(scores, lengths, logEmit)
+        return [[IDX2TAGS[idx] for idx in paths[b, :lengths[b]]]
+                for b in range(len(tokenLists))]
 
 
-    def matInit(self, firstWord, matProb):
+    def iterTags(self, sentences, batchSize = BATCH_SIZE):
         """
-        a function that assign the initial probabilities to a
-        HMM probability matrix.
+        a generator that yields the assigned tags of each sentence in
+        [sentences], decoding them [batchSize] sentences at a time.
         """
-        for tag, idx in TAGS.items():
-            lexProb = self.getLexProb(firstWord, tag)
-            transProb = self.getTransProb("<s>", tag)
-            matProb[idx, 0] = lexProb * transProb
+        batch = []
+        for sentence in sentences:
+            batch.append(sentence)
+            if len(batch) == batchSize:
+                yield from self.assignTagsBatch(batch)
+                batch = []
+        if batch:
+            yield from self.assignTagsBatch(batch)
+
+
+    def getLogEmit(self, tokens):
+        """
+        a function that returns the (5 x length) matrix of log emission
+        probabilities for a list of tokens.
+        """
+        ids = [self._wordIdx.get(token, self._unkId) for token in tokens]
+        return (self._logCounts[ids] - self._logTagCounts).T
 
 
     def getLexProb(self, word, tag):
         """
         a function that returns the probability of [word] given [tag]
         """
-        if word not in self._vocab:
-            word = '<UNK>'
-        if word not in self._lexicon[tag]:
-            num = 0
-        else:
-            num = self._lexicon[tag][word]
-        den = self._bigramNE._tokens[tag]
-        return num/den
+        self.refreshTables()
+        wordId = self._wordIdx.get(word, self._unkId)
+        idx = TAGS[tag]
+        return np.exp(self._logCounts[wordId, idx] - self._logTagCounts[idx])
 
 
     def getTransProb(self, firstTag, secondTag):
@@ -88,7 +217,70 @@ class HMM:
         a function that returns the transion (bigram) probabilities
         of a given pair of tags.
         """
-        return self._bigramNE.calBiProb(firstTag, secondTag)
+        self.refreshTables()
+        if firstTag == "<s>":
+            return np.exp(self._logStart[TAGS[secondTag]])
+        return np.exp(self._logTrans[TAGS[firstTag], TAGS[secondTag]])
+
+
+def viterbi(logStart, logTrans, logEmit):
+    """
+    a function that fills the viterbi matrix (log probabilities) and the
+    backpointer matrix for a sentence given the log start vector, the log
+    transition matrix and the (5 x length) log emission matrix. Each step
+    is a single broadcast over all (preTag, tag) pairs.
+    """
+    length = logEmit.shape[1]
+    matProb = np.empty((5, length))
+    matBP = np.zeros((5, length), np.int8)
+    matProb[:, 0] = logStart + logEmit[:, 0]
+
+    for i in range(1, length):
+        scores = matProb[:, i-1, None] + logTrans
+        matBP[:, i] = scores.argmax(axis = 0)
+        matProb[:, i] = scores.max(axis = 0) + logEmit[:, i]
+
+    return matProb, matBP
+
+
+def viterbiBatch(scores, lengths, logEmit = None):
+    """
+    a function that runs viterbi over padded (batch, max_len, 5, 5) log
+    scores indexed [sentence, position, preTag, tag], or (1, max_len, 5,
+    5) scores shared by every sentence, and returns the best paths of
+    the [lengths] sentences as a (batch, max_len) array of tag indexes.
+    The first position only uses the scores of its first preTag row.
+    The (batch, max_len, 5) log scores [logEmit] of each tag, if given,
+    are added after the best preTag is chosen. Columns past a sentence's
+    length carry its probabilities forward with identity backpointers,
+    so every sentence is backtraced together from the last column.
+    Shared by the HMM and the MEMM.
+    """
+    batch = len(lengths); maxLen = scores.shape[1]
+    rows = np.arange(batch)
+    identity = np.arange(5)
+    if logEmit is None:
+        logEmit = np.zeros((batch, maxLen, 5))
+
+    matProb = scores[:, 0, 0] + logEmit[:, 0]
+    matBP = np.zeros((batch, 5, maxLen), np.int8)
+
+    for i in range(1, maxLen):
+        tempScores = matProb[:, :, None] + scores[:, i]
+        backpointers = tempScores.argmax(axis = 1)
+        best = np.take_along_axis(tempScores, backpointers[:, None, :], 1)[:, 0]
+        best += logEmit[:, i]
+
+        active = (lengths > i)[:, None]
+        matProb = np.where(active, best, matProb)
+        matBP[:, :, i] = np.where(active, backpointers, identity)
+
+    paths = np.zeros((batch, maxLen), np.int8)
+    paths[:, -1] = matProb.argmax(axis = 1)
+    for i in range(maxLen - 1, 0, -1):
+        paths[:, i-1] = matBP[rows, paths[:, i], i]
+
+    return paths
 
 
 def getPath(matProb, matBP):
@@ -119,66 +311,48 @@ def getPath(matProb, matBP):
     return path
 
 
-def assignUnk(vocab):
+def assignUnk(wordIdx, counts):
     """
-    a function that decides the list of unknowns from a given vocab
+    a function that merges the first [max] words seen only once into a
+    single <UNK> entry and returns the re-indexed vocab and counts.
     """
-    unknowns = []
-    unkFreq = 0; unkNum = 0;
-    max = 20;
+    max = 20
+    singletons = (counts.sum(axis = 1) == 1).nonzero()[0][:max]
+    keep = np.ones(len(counts), bool)
+    keep[singletons] = False
 
-    for k, v in list(vocab.items()):
-        if v == 1:
-            unknowns.append(k)
-            unkFreq += v
-            unkNum += 1
-            vocab.pop(k)
+    words = [word for word, i in wordIdx.items() if keep[i]]
+    words.append(UNK)
+    newIdx = {word: i for i, word in enumerate(words)}
+    newCounts = np.vstack([counts[keep], counts[singletons].sum(axis = 0)])
+    return newIdx, newCounts
 
-        if unkNum == max:
-            vocab['<UNK>'] = unkFreq
-            break
 
-    return unknowns
-
-
-def addUnknown(lexicon, unknowns):
+def tagRecords(model, records):
     """
-    a function that adds unknown words to a built lexicon and returns
-    the total number of tokens after removal
+    a function that returns the assigned tags of a chunk of test records
+    (see [parallel.tagFile]).
     """
-    for tag in lexicon:
-        for word, count in list(lexicon[tag].items()):
-            if word in unknowns:
-                if '<UNK>' not in lexicon[tag]:
-                    lexicon[tag]['<UNK>'] = count
-                else:
-                    lexicon[tag]['<UNK>'] += count
-                lexicon[tag].pop(word)
+    return model.decodeBatch([record[0] for record in records])
 
 
-def evaluateHMM(train, trainNE, test):
+def evaluateHMM(train, test, workers = 1):
     """
     a function that returns the accuracy of the HMM model using a given
-    validation set.
+    validation set. The test set is tagged by [workers] processes.
     """
-    model = HMM(train, trainNE)
-    lines = preprocess.readFile(test)
-    lineNum = 1
+    model = HMM(train)
     correct = 0; total = 0
 
-    for line in lines:
-        if (lineNum % 3) == 1:
-            tags = model.assignTags(line)
-            addBio(tags)
-        elif (lineNum % 3) == 0:
-            answers = line.strip().split()
-            #Following line just for testing
-            assert len(tags) == len(answers)
-            for i in range(len(tags)):
-                if tags[i] == answers[i]:
-                    correct += 1
-                total += 1
-        lineNum += 1
+    for record, tags in parallel.tagFile(model, tagRecords, test, workers):
+        addBio(tags)
+        answers = record[2]
+        #Following line just for testing
+        assert len(tags) == len(answers)
+        for i in range(len(tags)):
+            if tags[i] == answers[i]:
+                correct += 1
+            total += 1
 
     return correct, total
 
@@ -210,9 +384,8 @@ def main():
     print("Hello user !")
 
     train = 'tempTrain.txt'
-    trainNE = 'temptrainNE.txt'
     test = 'tempTest.txt'
-    correct, total = evaluateHMM(train, trainNE, test)
+    correct, total = evaluateHMM(train, test)
 
     print("Out of " + str(total) + " tokens")
     print("HMM gets " + str(correct) + " corrects !")
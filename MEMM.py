@@ -1,5 +1,8 @@
+import os
 import preprocess
-import nltk
+import parallel
+import HMM
+import maxent
 import numpy as np
 
 #Feature set Format:
@@ -9,138 +12,231 @@ PRENE = '<n>'
 
 TAGS = {'O': 0, 'PER': 1, 'LOC': 2, 'ORG': 3, 'MISC': 4}
 IDX2TAGS = ['O', 'PER', 'LOC', 'ORG', 'MISC']
+FEATURES_FILE = "features.npy"
+WEIGHTS_FILE = "weights.npy"
 
 class MEMM:
 
-    def __init__(self, train):
-
-        self._trainCorpus = preprocess.MEMMpreprocess(train)
+    def __init__(self, train, workers = 1, maxTime = None, heldOut = None,
+    warmStart = None, tol = maxent.TOL, numIt = maxent.MAX_ITER):
+
+        #Continue from the weights of the model saved at [warmStart]: its
+        #features keep their ids and weights, new features start at zero.
+        #A warm start needs far fewer iterations, so pass a smaller [numIt]
+        init = None
+        if warmStart is not None:
+            previous = MEMM.load(warmStart, mmap = False)
+            self._featureMap = previous._featureMap
+            init = previous._weights
+        else:
+            self._featureMap = preprocess.FeatureMap()
+
+        features, labels = preprocess.MEMMfeatures(preprocess.iterRecords(train),
+        self._featureMap)
+        if heldOut is not None:
+            heldOut = preprocess.MEMMfeatures(preprocess.iterRecords(heldOut),
+            self._featureMap, grow = False)
 
         print("Training the MaxEnt classifier...")
-        self.classifier = genMaxEnt(self._trainCorpus)
+        self._weights = genMaxEnt(features, labels, len(self._featureMap),
+        numIt, workers = workers, maxTime = maxTime, heldOut = heldOut,
+        init = init, tol = tol)
         print("Done! MEMM model ready.")
+        self.makeNEids()
 
 
-    def assignTags(self, sentence, POS):
+    def __getstate__(self):
+        #Memory-mapped weights are re-mapped instead of copied
+        state = self.__dict__.copy()
+        if isinstance(self._weights, np.memmap):
+            state['_weights'] = self._weights.filename
+        return state
+
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if isinstance(self._weights, str):
+            self._weights = np.load(self._weights, mmap_mode = 'r')
+        self.makeNEids()
+
+
+    def save(self, path):
         """
-        a function that assigns tags to a given sentence (as a string)
-        and returns the assigned tags as a list.
+        a function that writes the trained model (feature names and the
+        weight matrix) as .npy files into the directory [path].
         """
-        tokens = sentence.strip().split()
-        POStags = POS.strip().split()
-        length = len(tokens)
+        os.makedirs(path, exist_ok = True)
+        np.save(os.path.join(path, FEATURES_FILE),
+        preprocess.packStrings(self._featureMap.names()))
+        np.save(os.path.join(path, WEIGHTS_FILE), self._weights)
 
-        matProb = np.zeros((5, length))             #matrix for the probability
-        matBP = np.zeros(5, str(length) + 'int8')   #matrix for the backpointers
-        self.matInit(tokens[0], POStags[0], matProb)
 
-        for col in range(1, length):
-            curToken = tokens[col]; curPOS = POStags[col]
-            preToken = tokens[col-1]; prevProb = matProb[:, col-1]
+    @classmethod
+    def load(cls, path, mmap = True):
+        """
+        a function that returns a MEMM model restored from the directory
+        [path] written by [save]. With [mmap] the weights are memory
+        mapped read-only, so processes loading the same model share them.
+        """
+        model = cls.__new__(cls)
+        names = preprocess.unpackStrings(np.load(os.path.join(path,
+        FEATURES_FILE)))
+        model._featureMap = preprocess.FeatureMap(names)
+        model._weights = np.load(os.path.join(path, WEIGHTS_FILE),
+        mmap_mode = 'r' if mmap else None)
+        model.makeNEids()
+        return model
 
-            for tag, row in TAGS.items():
-                tempPrev = prevProb.copy()
 
-                for preTag, j in TAGS.items():
-                    features = {preToken: True, preTag: True, curToken: True,
-                    curPOS: True}
-                    transProb = self.getProb(features, tag)
-                    tempPrev[j] = tempPrev[j] * transProb
+    def makeNEids(self):
+        """
+        a function that looks up the feature ids of the previous NE tag
+        template for every tag and for the start of a sentence.
+        """
+        NEtemplate = preprocess.TEMPLATES[1]
+        self._NEids = [self._featureMap.lookup(NEtemplate + tag)
+        for tag in IDX2TAGS]
+        self._startId = self._featureMap.lookup(NEtemplate + PRENE)
 
-                #Fill in the two matrixes
-                matProb[row, col] = tempPrev.max()
-                matBP[row, col] = tempPrev.argmax()
 
-        return getPath(matProb, matBP)
+    def assignTags(self, sentence, POS):
+        """
+        a function that assigns tags to a given sentence (as a string)
+        and returns the assigned tags as a list.
+        """
+        return self.decode(sentence.strip().split(), POS.strip().split())
 
 
-    def matInit(self, firstWord, firstPOS, matProb):
+    def decode(self, tokens, POStags):
+        """
+        a function that assigns tags to a sentence given as a list of
+        tokens and a list of POS tags.
+        """
+        return self.decodeBatch([(tokens, POStags)])[0]
+
+
+    def decodeBatch(self, sentences):
+        """
+        a function that assigns tags to a batch of (tokens, POS tags)
+        sentences. The feature rows of every (position, previous tag)
+        pair of the batch are scored against the weight matrix at once,
+        and the resulting (batch, max_len, 5, 5) log-softmax scores are
+        decoded by a single padded viterbi pass.
         """
-        a function that assign the initial probabilities to a
-        MEMM probability matrix.
+        if not sentences:
+            return []
+        lengths = np.array([len(tokens) for tokens, _ in sentences])
+        maxLen = max(lengths.max(), 1)
+        mask = np.arange(maxLen) < lengths[:, None]
+
+        #Sparse rows times weights: the rows share their <preToken,
+        #curToken, curPOS> ids and only differ in the previous tag id.
+        ids = np.vstack([preprocess.sentenceIds(tokens, POStags,
+        self._featureMap) for tokens, POStags in sentences])
+        base = np.zeros((len(sentences), maxLen, 5))
+        base[mask] = self._weights[0] + self._weights[ids].sum(axis = 1)
+
+        #Scores indexed [sentence, position, preTag, tag]
+        scores = base[:, :, None, :] + self._weights[self._NEids]
+        scores[:, 0] = base[:, 0, None, :] + self._weights[self._startId]
+        scores -= maxent.logSumExp(scores, axis = 3)[..., None]
+
+        paths = HMM.viterbiBatch(scores, lengths)
+        return [[IDX2TAGS[idx] for idx in paths[b, :lengths[b]]]
+                for b in range(len(sentences))]
+
+
+    def classify(self, *ids):
         """
-        features = {PRETOKEN: True, PRENE: True, firstWord: True, firstPOS: True}
-        for tag, idx in TAGS.items():
-            matProb[idx, 0] = self.getProb(features, tag)
+        a function that returns the log probabilities of all tags (in
+        the order of IDX2TAGS) for a word with the given feature [ids].
+        """
+        scores = self._weights[list(ids)].sum(axis = 0)
+        return scores - maxent.logSumExp(scores)
 
 
     def getProb(self, features, NE):
         """
         a function that returns the probability of a word with given
-        [features] being labled [NE] by a maxEnt [classifier].
+        [features] = <preToken, preNE, curToken, curPOS> being labled
+        [NE] by the maxEnt classifier.
         """
-        distribution = self.classifier.prob_classify(features)
-        return distribution.prob(NE)
+        ids = preprocess.templateIds(features, self._featureMap.lookup)
+        return np.exp(self.classify(*ids)[TAGS[NE]])
 
 
 
-def genMaxEnt(trainTokens):
+def genMaxEnt(features, labels, numFeatures, numIt = maxent.MAX_ITER,
+workers = 1, maxTime = None, heldOut = None, init = None, tol = maxent.TOL):
     """
-    a function that generates the maxEnt classifier of nltk using a given
-    trianing corpus.
+    a function that returns the weights of the maxEnt classifier trained
+    on the (tokens x 5) feature id matrix [features] and [labels], with
+    the instances sharded across [workers] training processes. Training
+    stops early after [maxTime] seconds, once the objective decreases by
+    less than [tol] (relative, see [maxent.fit]) or once the accuracy on
+    the [heldOut] (features, labels) pair stops improving. Training starts
+    from the weights [init] of the first features, if given.
     """
-    #Note: For numIt, the default iterations of nltk's maxEnt package is
-    #100 which would take nearly 2 hours to train, but 30 tends to give
-    #good enough accuracy and takes only about 30 min.
-    numIt = 1
-    return nltk.MaxentClassifier.train(trainTokens, max_iter = numIt)
+    #Note: the L-BFGS trainer usually converges well within its default
+    #100 iterations, which take a few minutes on train.txt.
+    if heldOut is not None:
+        heldOut = toCSR(*heldOut)
+    return maxent.fit(*toCSR(features, labels), numFeatures, len(IDX2TAGS),
+    numIt, workers = workers, tol = tol, maxTime = maxTime,
+    heldOut = heldOut, init = init)
 
 
-def getPath(matProb, matBP):
+def toCSR(features, labels):
     """
-    a function that returns the best path, aka assigned tags, for a
-    given viberti matrix with all backpointers and probabilities
-    generated.
+    a function that returns the (indptr, indices, labels) CSR form of a
+    fixed width feature id matrix.
     """
-    if len(matProb[1]) == 1:
-        return [IDX2TAGS[matProb.argmax()]]
+    indptr = np.arange(0, features.size + 1, features.shape[1])
+    return indptr, features.ravel(), labels
 
-    path = []
-    currentIndex = len(matProb[1])-1
 
-    #Get tag of last column
-    lastColumn = matProb[:, currentIndex]
-    maxValueIndex = lastColumn.argmax()
-    path.insert(0, IDX2TAGS[maxValueIndex])
+def getModel(train, modelPath = None):
+    """
+    a function that returns the MEMM model saved at [modelPath] if there
+    is one, otherwise trains it on [train] (and saves it to [modelPath]).
+    A saved model is used even if [train] has changed since.
+    """
+    if modelPath is not None and os.path.isdir(modelPath):
+        print("Loading the MEMM model saved at %s (delete it to retrain)..."
+        % modelPath)
+        return MEMM.load(modelPath)
+    model = MEMM(train)
+    if modelPath is not None:
+        model.save(modelPath)
+    return model
 
-    #follows the backpointer and assign tags to the rest of the sentence
-    backpointer = matBP[maxValueIndex][currentIndex]
-    while currentIndex > 0:
-        currentIndex -= 1
-        tag = IDX2TAGS[backpointer]
-        path.insert(0, tag)
-        backpointer = matBP[backpointer][currentIndex]
 
-    return path
+def tagRecords(model, records):
+    """
+    a function that returns the assigned tags of a chunk of test records
+    (see [parallel.tagFile]).
+    """
+    return model.decodeBatch([(record[0], record[1]) for record in records])
 
 
-def evaluateMEMM(train, test):
+def evaluateMEMM(train, test, workers = 1, modelPath = None):
     """
     a function that returns the accuracy of the MEMM model using a given
-    validation set.
+    validation set. The test set is tagged by [workers] processes. See
+    [getModel] for [modelPath].
     """
-    model = MEMM(train)
-    lines = preprocess.readFile(test)
-    lineNum = 1
+    model = getModel(train, modelPath)
     correct = 0; total = 0
 
-    for line in lines:
-        if (lineNum % 3) == 1:
-            sentence = line
-
-        elif (lineNum % 3) == 2:
-            tags = model.assignTags(sentence, line)
-            addBio(tags)
-
-        elif (lineNum % 3) == 0:
-            answers = line.strip().split()
-            #Following line just for testing
-            #assert len(tags) == len(answers)
-            for i in range(len(tags)):
-                if tags[i] == answers[i]:
-                    correct += 1
-                total += 1
-        lineNum += 1
+    for record, tags in parallel.tagFile(model, tagRecords, test, workers):
+        addBio(tags)
+        answers = record[2]
+        #Following line just for testing
+        #assert len(tags) == len(answers)
+        for i in range(len(tags)):
+            if tags[i] == answers[i]:
+                correct += 1
+            total += 1
 
     return correct, total
 
@@ -2,6 +2,8 @@
 This python script constructs a baseline NER tagging model.
 """
 import preprocess
+import parallel
+import gazetteer
 
 class Baseline:
 
@@ -12,16 +14,15 @@ class Baseline:
 	def __init__(self, filepath):
 
 		"""
-		The constructor initializes the corpus to be stored in the model.
-		It creates a dictionary of tokens and taggs. Also a default tag used
-        for unseen tokens.
+		The constructor compiles the labelled entity spans of the corpus
+		into a gazetteer (see [gazetteer.build]).
 
 		Input
 		-----
-		- filepath: The path of the file to be read in
+		- filepath: The path of the file to be read in, or its records
+		  parsed by [preprocess.asRecords]
 		"""
-		self._dict = preprocess.baselineDict(filepath)
-		self._defaultTag = 'O'
+		self._gazetteer = gazetteer.build(lambda: preprocess.iterRecords(filepath))
 
 
 	def assignTags(self, sentence):
@@ -34,52 +35,46 @@ class Baseline:
 
 		output
 		-------
-		returns the tags as a list with same length as [sentence]
-
+		returns the BIO tags as a list with same length as [sentence],
+		assigned by longest match against the gazetteer
 		"""
-		tags = sentence.copy()
-		for i in range(len(tags)):
-			word = tags[i]
-			if word not in self._dict:
-				tags[i] = self._defaultTag
-			else:
-				tags[i] = self._dict[word]
-
-		return tags
+		return self._gazetteer.assignTags(sentence)
 
 
-	def scoreBaseLine(self, filepath):
+	def scoreBaseLine(self, filepath, workers = 1):
 		"""
 		A function that grades the models accuracy using a given test
-		file specified by [filepath].
+		file specified by [filepath]. The file is tagged by [workers]
+		processes.
 		"""
-		lines = preprocess.readFile(filepath)
-		lineNum = 1
 		correct = 0
 		total = 0
-		for line in lines:
-			if (lineNum % 3) == 1:
-				tokens = line.strip().split()
-				tags = self.assignTags(tokens)
-			elif (lineNum % 3) == 0:
-				answers = line.strip().split()
-
-                #Following section just for testing
-				if len(tags) != len(answers):
-					print("Lengths don't match!\n")
-					print(tags)
-					print(answers)
-					break
-
-				for i in range(len(tags)):
-					if tags[i] == answers[i]:
-						correct += 1
-					total += 1
-			lineNum += 1
+		for record, tags in parallel.tagFile(self, tagRecords, filepath, workers):
+			answers = record[2]
+
+			#Following section just for testing
+			if len(tags) != len(answers):
+				print("Lengths don't match!\n")
+				print(tags)
+				print(answers)
+				break
+
+			for i in range(len(tags)):
+				if tags[i] == answers[i]:
+					correct += 1
+				total += 1
 
 		return correct, total
 
 
+def tagRecords(model, records):
+	"""
+	A function that returns the assigned tags of a chunk of test records
+	(see [parallel.tagFile]).
+	"""
+	return [model.assignTags(record[0]) for record in records]
+
+
 def main():
     train_file = "tempTrain.txt"
     test_file = "tempTest.txt"
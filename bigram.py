@@ -6,8 +6,11 @@ Authors: Sena Katako, Vivian Gao, Xianyi Han
 """
 
 import math
-from random import uniform, randint
+import os
 import csv
+from itertools import islice
+
+import numpy as np
 
 BEGINNING_OF_SENTENCE = "<s>"
 END_OF_SENTENCE = "</s>"
@@ -15,6 +18,18 @@ UNKNOWN_WORD = "<UNK>"
 #For postprocessings
 STOPPERS = ['.', '?', '!']
 IREGULARS = [',', '’']
+#For unknown words
+THRESHOLD = 2   #words with frequency < [THRESHOLD] are replaced by Unknown
+MAX_UNK = 20    #Maximum number of words replaced as Unknown
+#For sentence generation
+MAX_WORDS = 20  #Maximum number of words of a generated sentence
+#For classification
+BATCH_SIZE = 1024   #Number of lines scored together
+#Files of a saved BigramLM
+WORDS_FILE = "words.txt"
+COUNTS_FILE = "counts.npy"
+BIGRAMS_DIR = "bigrams"
+BIGRAMS_UNK_DIR = "bigramsUnk"
 
 class UnigramLM:
 
@@ -34,9 +49,75 @@ class UnigramLM:
 		- filepath: The path of the file to be read in
 		"""
 
-		sentences = readFile(filepath)
-		self._tokens, self._num_words = makeUnigrams(sentences)
-		self._tokensUnk, self._removedList = makeUnkUni(self._tokens)
+		self._wordIdx, ids, starts = encodeCorpus(readFile(filepath))
+		self._words = list(self._wordIdx)
+		self.makeCounts(ids, starts)
+
+
+	def makeCounts(self, ids, starts):
+		"""
+		Counts the corpus given as an array of word [ids] whose sentences
+		begin at the offsets [starts] (see [encodeCorpus]).
+
+		The counts are arrays indexed by word id. [_unkMap] maps every
+		word id to its id after handling unknowns, where removed words
+		share the id of UNKNOWN_WORD.
+		"""
+		self._unkId = self._wordIdx.setdefault(UNKNOWN_WORD, len(self._wordIdx))
+		if self._unkId == len(self._words):
+			self._words.append(UNKNOWN_WORD)
+
+		self.setCounts(np.bincount(ids, minlength = len(self._words)))
+
+
+	def setCounts(self, counts):
+		"""
+		Sets the unigram [counts] (an array indexed by word id) and derives
+		the counts after handling unknowns from them.
+		"""
+		self._counts = counts
+		self._num_words = int(counts.sum())
+
+		self._unkMap, removed = makeUnkIds(self._counts, self._unkId)
+		self._removedList = [self._words[i] for i in removed]
+		self._countsUnk = np.bincount(self._unkMap, weights = self._counts,
+			minlength = len(self._words)).astype(np.int64)
+		#Number of distinct tokens once unknowns are handled
+		self._numTypesUnk = len(self._words) - len(removed)
+
+		#The probability tables are derived from the counts
+		self._tables = {}
+
+
+	def cachedTable(self, name, build):
+		"""
+		Returns the probability table [name], calling [build] to make it
+		the first time it is needed after the counts were (re)made. The
+		returned tables are shared and must not be modified.
+		"""
+		if name not in self._tables:
+			self._tables[name] = build()
+		return self._tables[name]
+
+
+	def wordIds(self, words):
+		"""
+		Returns the array of ids of [words], with -1 for words not seen in
+		training.
+		"""
+		return np.fromiter((self._wordIdx.get(word, -1) for word in words),
+			np.int64, len(words))
+
+
+	def wordIdsUnk(self, words, ids = None):
+		"""
+		Returns the array of ids of [words] after handling unknowns; words
+		not seen in training get the id of UNKNOWN_WORD. Their [ids] from
+		[wordIds] can be given instead of being looked up again.
+		"""
+		if ids is None:
+			ids = self.wordIds(words)
+		return self._unkMap[np.where(ids < 0, self._unkId, ids)]
 
 
 	def calWordProbUnk(self, word):
@@ -55,11 +136,8 @@ class UnigramLM:
 
 		"""
 
-		if word not in self._tokensUnk:
-			value = self._tokensUnk.get(UNKNOWN_WORD, 0)
-		else:
-			value = self._tokensUnk.get(word, 0)
-		return value/self._num_words
+		wordId = self._unkMap[self._wordIdx.get(word, self._unkId)]
+		return self._countsUnk[wordId]/self._num_words
 
 
 	def makeUnigramProbTable(self):
@@ -67,61 +145,102 @@ class UnigramLM:
 		"""
 		Returns the log probability table of the unigram. Does not include
 		Unknown Words as the table is intended for random sentence generation.
+		The table is built once (see [cachedTable]).
 
 		Output
 		------
 		probTable: a dictionary of {unigram: log probability}
 		"""
 
-		probTable = {k: math.log(v/self._num_words) for k,v in self._tokens.items()}
+		def build():
+			seen = self._counts.nonzero()[0]
+			logProbs = np.log(self._counts[seen]/self._num_words)
+			return dict(zip([self._words[i] for i in seen], logProbs.tolist()))
 
-		return probTable
+		return self.cachedTable('unigram', build)
 
 
-	def generateRandomUnigramSentences(self, seed = "", generate = True):
+	def logProbsUnk(self):
 
 		"""
-		This function calculates the probability of a bigram relative
-		to all the bigrams that share the same start word.
+		Returns the array of log probabilities of all word ids after
+		handling unknowns (-inf for removed words). Built once.
+		"""
+
+		def build():
+			with np.errstate(divide = 'ignore'):
+				return np.log(self._countsUnk/self._num_words)
+
+		return self.cachedTable('unigramUnk', build)
+
+
+	def unigramCdf(self):
+
+		"""
+		Returns the ids of the words seen in training and the cumulative
+		sums of their counts, the table [sampleUnigrams] draws from.
+		Built once.
+		"""
+
+		def build():
+			seen = self._counts.nonzero()[0]
+			return seen, np.cumsum(self._counts[seen])
+
+		return self.cachedTable('unigramCdf', build)
+
+
+	def sampleUnigrams(self, size, rng):
+
+		"""
+		Returns [size] words drawn from the unigram distribution with the
+		numpy random generator [rng], by binary search in the cumulative
+		counts (O(log V) per word).
+		"""
+
+		seen, cdf = self.unigramCdf()
+		draws = rng.integers(cdf[-1], size = size)
+		return [self._words[i] for i in seen[np.searchsorted(cdf, draws, 'right')]]
+
+
+	def generateRandomUnigramSentences(self, seed = "", generate = True,
+		rng = None):
+
+		"""
+		This function returns a randomly generated sentence of words drawn
+		from the unigram distribution.
 
 		Input
 		------
 		- seed: the incomplete sentence to start the generation with
 		- generate: determines whether a random unigram sentence should be formed
+		- rng: the numpy random generator to draw from (a new one if None)
 
 		Output
 		------
 		- sentence: the randomly generated sentence
 
 		"""
-		table = self.makeUnigramProbTable()
+		if rng is None:
+			rng = np.random.default_rng()
 
 		sentence = seed.strip()
 
-		max = 20
 		count = len(sentence.split())
 
 		while generate:
 
-			n = uniform(0,1)
-			interval = 0
-
-			for k,v in table.items():
-
-				interval += math.exp(v)
-				if interval >= n:
+			for k in self.sampleUnigrams(MAX_WORDS, rng):
 
-					if k == END_OF_SENTENCE:
-						if len(sentence) != 0:
-							generate = False
-					elif k not in STOPPERS and k != BEGINNING_OF_SENTENCE:
-						sentence = " ".join([sentence, k])
-						count += 1
-
-					if (count == max) or generate == False:
+				if k == END_OF_SENTENCE:
+					if len(sentence) != 0:
 						generate = False
-						sentence = "".join([sentence, "."])
+				elif k not in STOPPERS and k != BEGINNING_OF_SENTENCE:
+					sentence = " ".join([sentence, k])
+					count += 1
 
+				if (count == MAX_WORDS) or generate == False:
+					generate = False
+					sentence = "".join([sentence, "."])
 					break
 
 		for s in STOPPERS:
@@ -133,6 +252,17 @@ class UnigramLM:
 		return sentence.strip()
 
 
+	def generate(self, n, seed = None):
+
+		"""
+		Returns a list of [n] randomly generated sentences. The same
+		[seed] (for numpy's default_rng) always gives the same sentences.
+		"""
+
+		rng = np.random.default_rng(seed)
+		return [self.generateRandomUnigramSentences(rng = rng) for _ in range(n)]
+
+
 	def unigramPerplexity(self, setOfWords):
 
 		"""
@@ -147,18 +277,62 @@ class UnigramLM:
 		------
 		- perplexity: The calculated perplexity.
 		"""
-		total = 0
-		n = 0
-
-		for word in setOfWords:
-			prob = self.calWordProbUnk(word)
-			total += -1 * math.log(prob)
-			n += 1
-		perplexity = math.exp((1 / n)* total)
+		ids = self.wordIdsUnk(setOfWords)
+		logProbs = self.logProbsUnk()[ids]
+		perplexity = math.exp(-logProbs.mean())
 
 		return perplexity
 
 
+	def tokenLogProbs(self, words, starts):
+		"""
+		Returns the log probabilities of the tokens of a development set
+		given as the list of all its [words] and the array of offsets where
+		each sentence [starts], and the index of the sentence of each one.
+		For the unigram model every word is a token.
+		"""
+		logProbs = self.logProbsUnk()[self.wordIdsUnk(words)]
+		segments = np.repeat(np.arange(len(starts)),
+			np.diff(np.append(starts, len(words))))
+		return logProbs, segments
+
+
+	def scoreSentences(self, sentences):
+		"""
+		A function that scores a development set in one vectorized pass.
+
+		Input
+		------
+		- sentences: The development set as lists of word tokens (see
+		  [readTest]).
+
+		Output
+		------
+		- logProbs: An array with the log probability of every sentence.
+		- perplexities: An array with the perplexity of every sentence
+		  (1 for sentences without tokens).
+		- perplexity: The perplexity of the whole set.
+		"""
+		words, starts = flattenLines(sentences)
+		tokenLogProbs, segments = self.tokenLogProbs(words, starts)
+
+		logProbs = np.bincount(segments, weights = tokenLogProbs,
+			minlength = len(starts))
+		counts = np.bincount(segments, minlength = len(starts))
+		perplexities = np.exp(-logProbs/np.maximum(counts, 1))
+		perplexity = math.exp(-tokenLogProbs.sum()/max(len(tokenLogProbs), 1))
+
+		return logProbs, perplexities, perplexity
+
+
+	def scoreFile(self, filepath):
+		"""
+		A function that scores the development set at [filepath] (see
+		[scoreSentences]).
+		"""
+		return self.scoreSentences(readTest(filepath))
+
+
 class BigramLM(UnigramLM):
 
 	"""
@@ -169,8 +343,8 @@ class BigramLM(UnigramLM):
 
 		"""
 		The constructor initializes the corpus to be stored in the bigram model.
-		It inherits from the Unigram Language Model and also creates a dictionary
-		of bigrams and counts.
+		It inherits from the Unigram Language Model and also counts the bigrams
+		into compact stores (see [BigramStore]).
 
 		Input
 		-----
@@ -178,10 +352,54 @@ class BigramLM(UnigramLM):
 		"""
 		super().__init__(filepath)
 
-		sentences = readFile(filepath)
-		self._separatedbigrams = makeBigrams(sentences)
 
-		#self._bigramsUnk = makeUnkBi(sentences, self._removedList)
+	def makeCounts(self, ids, starts):
+		"""
+		Counts the unigrams (see [UnigramLM.makeCounts]) and the bigrams
+		of the corpus, with and without handling unknowns. Bigram counts
+		are kept in a compact [BigramStore] each.
+		"""
+		super().makeCounts(ids, starts)
+
+		numWords = len(self._words)
+		endId = self._wordIdx.get(END_OF_SENTENCE)
+		self._bigrams = BigramStore.fromCodes(*countBigrams(ids, starts,
+			numWords, endId), numWords)
+		self._bigramsUnk = BigramStore.fromCodes(*countBigrams(self._unkMap[ids],
+			starts, numWords, endId), numWords)
+
+
+	def save(self, path):
+		"""
+		Writes the model (vocabulary, unigram counts and both bigram stores)
+		into the directory [path].
+		"""
+		os.makedirs(path, exist_ok = True)
+		with open(os.path.join(path, WORDS_FILE), 'w', encoding = "utf-8") as f:
+			f.write('\n'.join(self._words))
+		np.save(os.path.join(path, COUNTS_FILE), self._counts)
+		self._bigrams.save(os.path.join(path, BIGRAMS_DIR))
+		self._bigramsUnk.save(os.path.join(path, BIGRAMS_UNK_DIR))
+
+
+	@classmethod
+	def load(cls, path, mmap = True):
+		"""
+		Returns a model restored from the directory [path] written by
+		[save]. With [mmap] the bigram stores are memory mapped read-only
+		instead of being read into memory.
+		"""
+		model = cls.__new__(cls)
+		with open(os.path.join(path, WORDS_FILE), encoding = "utf-8") as f:
+			model._words = f.read().split('\n')
+		model._wordIdx = {word: i for i, word in enumerate(model._words)}
+		model._unkId = model._wordIdx[UNKNOWN_WORD]
+
+		model.setCounts(np.load(os.path.join(path, COUNTS_FILE)))
+		model._bigrams = BigramStore.load(os.path.join(path, BIGRAMS_DIR), mmap)
+		model._bigramsUnk = BigramStore.load(os.path.join(path, BIGRAMS_UNK_DIR),
+			mmap)
+		return model
 
 
 	def calBiProb(self, firstWord, secondWord):
@@ -189,12 +407,12 @@ class BigramLM(UnigramLM):
 		a function that returns probability of a given bigram without
 		smoothing.
 		"""
-		if secondWord not in self._separatedbigrams[firstWord]:
-			num = 0
-		else:
-			num = self._separatedbigrams[firstWord][secondWord]
+		firstId = self._wordIdx[firstWord]
+		secondId = self._wordIdx.get(secondWord, -1)
 
-		den = self._tokens[firstWord]
+		num = int(self._bigrams.lookup(firstId, secondId)) if secondId >= 0 else 0
+
+		den = self._counts[firstId]
 		return num/den
 
 
@@ -213,24 +431,17 @@ class BigramLM(UnigramLM):
 		------
 		- prob: the probability of the bigram
 		"""
-		v = len(self._tokensUnk) #Number of tokens
+		v = self._numTypesUnk #Number of tokens
 
 		#Possible Edge Case?
 		if firstWord == END_OF_SENTENCE:
 			return 0
 
-		if firstWord not in self._tokensUnk:
-			firstWord = UNKNOWN_WORD
+		firstId, secondId = self.wordIdsUnk([firstWord, secondWord])
 
-		if secondWord not in self._tokensUnk:
-			secondWord = UNKNOWN_WORD
+		num = int(self._bigramsUnk.lookup(firstId, secondId)) + 1
 
-		if secondWord not in self._bigramsUnk[firstWord]:
-			num = 1
-		else:
-			num = self._bigramsUnk[firstWord][secondWord] + 1
-
-		den = self._tokensUnk[firstWord] + v
+		den = self._countsUnk[firstId] + v
 
 		return num/den
 
@@ -240,25 +451,155 @@ class BigramLM(UnigramLM):
 		"""
 		Returns the log probability table of a Bigram. Does not include
 		Unknown Words or implement smoothing as the function is intended
-		for random sentence generation.
+		for random sentence generation. The table is built once (see
+		[cachedTable]).
 
 		Output
 		------
 		probTable: a dictionary of {bigrams: log probability}
 		"""
 
-		probTable = {}
+		def build():
+			probTable = {}
+
+			firsts = self._bigrams.firsts()
+			seconds = self._bigrams.seconds()
+			logProbs = self.logProbs()
+
+			for k, s, p in zip(firsts.tolist(), seconds.tolist(), logProbs.tolist()):
+				probTable.setdefault(self._words[k], {})[self._words[s]] = p
+
+			return probTable
+
+		return self.cachedTable('bigram', build)
+
+
+	def logProbs(self):
+
+		"""
+		Returns the array of unsmoothed log probabilities of the bigrams,
+		aligned with the bigram store. Built once.
+		"""
+
+		def build():
+			firsts = self._bigrams.firsts()
+			return np.log(self._bigrams.counts()/self._counts[firsts])
+
+		return self.cachedTable('bigramLog', build)
+
+
+	def logProbsLap(self):
+
+		"""
+		Returns the add-one smoothed log probabilities of the bigrams after
+		handling unknowns: an array aligned with the unknown bigram store, and
+		an array over first word ids for the bigrams never seen. Built once.
+		"""
+
+		def build():
+			firsts = self._bigramsUnk.firsts()
+			dens = self._countsUnk + self._numTypesUnk
+			seen = np.log((self._bigramsUnk.counts() + 1.0)/dens[firsts])
+			return seen, -np.log(dens)
+
+		return self.cachedTable('bigramLap', build)
+
+
+	def calBiLogProbLap(self, firstIds, secondIds):
+
+		"""
+		Returns the add-one smoothed log probabilities of the bigrams of
+		word ids ([firstIds], [secondIds]) after handling unknowns (see
+		[wordIdsUnk]), from the cached [logProbsLap] table.
+		"""
+
+		seen, unseen = self.logProbsLap()
+		pos, found = self._bigramsUnk.find(firstIds, secondIds)
+
+		return np.where(found, seen[pos], unseen[firstIds])
+
+
+	def calBiLogProbSeq(self, firstIds, secondIds):
+
+		"""
+		Returns the log probabilities used by [seqProbability] for the
+		bigrams of word ids ([firstIds], [secondIds]) from [wordIds]: the
+		unsmoothed probability of bigrams seen in training, and the add-one
+		smoothed one (see [calBiLogProbLap]) of the others.
+		"""
+
+		known = (firstIds >= 0) & (secondIds >= 0)
+		pos, found = self._bigrams.find(np.where(known, firstIds, 0), secondIds)
+		found &= known
+
+		smoothed = self.calBiLogProbLap(self.wordIdsUnk(None, firstIds),
+			self.wordIdsUnk(None, secondIds))
+
+		return np.where(found, self.logProbs()[pos], smoothed)
+
+
+	def bigramCdf(self):
+
+		"""
+		Returns the table [sampleBigrams] draws from: the offsets of each
+		first word id's bigrams in the bigram store (CSR layout), the
+		second word ids and the cumulative sums of the bigram counts
+		(starting with 0). Built once.
+		"""
+
+		def build():
+			cdf = np.concatenate([[0], np.cumsum(self._bigrams.counts(),
+				dtype = np.int64)])
+			return self._bigrams.indptr(), self._bigrams.seconds(), cdf
+
+		return self.cachedTable('bigramCdf', build)
+
+
+	def sampleBigrams(self, contextIds, rng):
+
+		"""
+		Returns an array with the id of a word drawn after each word id of
+		[contextIds], using the numpy random generator [rng]. Each draw is
+		a binary search in the cumulative counts of the context's bigrams
+		(O(log V)). Contexts never followed by a word get -1.
+		"""
+
+		indptr, seconds, cdf = self.bigramCdf()
+		starts = indptr[contextIds]
+		ends = indptr[contextIds + 1]
+
+		totals = cdf[ends] - cdf[starts]
+		draws = cdf[starts] + (rng.random(len(contextIds)) * totals).astype(np.int64)
+
+		pos = np.minimum(np.searchsorted(cdf, draws, 'right') - 1, len(seconds) - 1)
+		return np.where(totals > 0, seconds[pos].astype(np.int64), -1)
 
-		for k,v in self._separatedbigrams.items():
 
-			probTable[k] = {}
-			for s,t in v.items():
-				probTable[k][s] = math.log(t/self._tokens[k])
+	def generateBigramIds(self, contextIds, maxWords, rng):
 
-		return probTable
+		"""
+		Draws sentences that continue the words [contextIds] together,
+		one word per step, until END_OF_SENTENCE, a word never followed by
+		another, or [maxWords] words. Returns a (sentences x maxWords)
+		array of word ids padded with -1.
+		"""
 
+		endId = self._wordIdx.get(END_OF_SENTENCE, -1)
+		ids = np.full((len(contextIds), maxWords), -1)
+		alive = np.ones(len(contextIds), bool)
 
-	def generateRandomBigramSentences(self, seed=""):
+		for i in range(maxWords):
+			nextIds = np.where(alive, self.sampleBigrams(contextIds, rng), -1)
+			ids[:, i] = nextIds
+			alive &= (nextIds >= 0) & (nextIds != endId)
+			if not alive.any():
+				break
+			contextIds = np.where(alive, nextIds, contextIds)
+
+		return ids
+
+
+	def generateRandomBigramSentences(self, seed = "", rng = None):
 
 		"""
 		This function returns a randomly generated sentence that starts from
@@ -267,67 +608,50 @@ class BigramLM(UnigramLM):
 		Input
 		------
 		- seed: the incomplete sentence start the genration with
-		- generate: determines whether a random unigram sentence should be formed
+		- rng: the numpy random generator to draw from (a new one if None)
 
 		Output
 		------
 		- sentence: the randomly generated sentence
 
 		"""
-
-		table = self.makeBigramProbTable()
+		if rng is None:
+			rng = np.random.default_rng()
 
 		sentence = seed.strip()
-		prev_word = ""
-
-		n = uniform(0,1)
-		interval = 0
-		max = 20
-		counter = len(sentence.split())
 
 		if sentence == "":
 			#Choose a random word to start
-			for k, v in table[BEGINNING_OF_SENTENCE].items():
-				interval += math.exp(v)
-
-				if interval >= n:
-					sentence = k
-					prev_word = k
-					counter += 1
-					break
+			context = BEGINNING_OF_SENTENCE
 		else:
 			#Assume seed has known words only
-			prev_word = sentence.split()[-1]
+			context = sentence.split()[-1]
 
+		counter = len(sentence.split())
+		words = []
+		#A seed of MAX_WORDS words or more is only finished with a stopper
+		if counter < MAX_WORDS:
+			contextIds = np.array([self._wordIdx[context]])
+			ids = self.generateBigramIds(contextIds, MAX_WORDS - counter, rng)[0]
+			words = [self._words[i] for i in ids if i >= 0]
 
-		while END_OF_SENTENCE not in sentence and counter < max:
-			interval = 0
-			tokens = table[prev_word]
-			n = uniform(0,1)
-
-			for k,v in tokens.items():
+		return finishBigramSentence(" ".join([sentence] + words).strip())
 
-				interval += math.exp(v)
 
-				if interval >= n or k == END_OF_SENTENCE:
-					sentence = " ".join([sentence, k])
-					prev_word = k
-					counter += 1
-					break
+	def generate(self, n, seed = None):
 
-		#PostProcessings:
-		sentence = sentence.replace(" </s>", "")
+		"""
+		Returns a list of [n] randomly generated bigram sentences, all
+		drawn together (see [generateBigramIds]). The same [seed] (for
+		numpy's default_rng) always gives the same sentences.
+		"""
 
-		if sentence[-1:] in STOPPERS:
-			sentence = sentence.replace(sentence[-2:], sentence[-1:])
-		else:
-			#When sentence ends due to reaching maximum length
-			sentence = "".join([sentence, "."])
+		rng = np.random.default_rng(seed)
+		contextIds = np.full(n, self._wordIdx[BEGINNING_OF_SENTENCE])
+		ids = self.generateBigramIds(contextIds, MAX_WORDS, rng)
 
-		for r in IREGULARS:
-			sentence = sentence.replace((' ' + r), r)
-
-		return sentence
+		return [finishBigramSentence(" ".join([self._words[i] for i in row if i >= 0]))
+			for row in ids.tolist()]
 
 
 	def bigramPerplexity(self, setOfWords):
@@ -345,29 +669,63 @@ class BigramLM(UnigramLM):
  	    - perplexity: The calculated perplexity value.
  	    """
 
- 	    total = 0
- 	    n = 0
+ 	    ids = self.wordIdsUnk(setOfWords)
+ 	    keep = np.array(setOfWords[:-1], object) != END_OF_SENTENCE
 
- 	    for i in range(1, len(setOfWords)):
+ 	    logProbs = self.calBiLogProbLap(ids[:-1][keep], ids[1:][keep])
 
- 	    	prevWord = setOfWords[i-1]
- 	    	currentWord = setOfWords[i]
+ 	    perplexity = math.exp(-logProbs.mean())
 
- 	    	if prevWord != END_OF_SENTENCE:
- 	    		prob = self.calBiProbLap(prevWord, currentWord)
- 	    		total += -1 * math.log(prob)
- 	    		n += 1
+ 	    return perplexity
 
- 	    perplexity = math.exp((1 / n)* total)
 
- 	    return perplexity
+	def tokenLogProbs(self, words, starts):
+		"""
+		Returns the add-one smoothed log probabilities of the bigrams
+		within the sentences of a development set (see
+		[UnigramLM.tokenLogProbs]) and the index of the sentence of each
+		one. Bigrams starting with END_OF_SENTENCE are skipped.
+		"""
+		ids = self.wordIdsUnk(words)
+
+		#Pairs across two sentences end right before a sentence start
+		keep = np.ones(max(len(words) - 1, 0), bool)
+		keep[starts[(starts > 0) & (starts < len(words))] - 1] = False
+		keep &= np.array(words[:-1], object) != END_OF_SENTENCE
+		second = np.flatnonzero(keep) + 1
+
+		logProbs = self.calBiLogProbLap(ids[second - 1], ids[second])
+		segments = np.searchsorted(starts, second, 'right') - 1
+		return logProbs, segments
 #Class Mehtods Ends Here
 
 
+def finishBigramSentence(sentence):
+
+	"""
+	Post-processes a generated bigram sentence: removes END_OF_SENTENCE,
+	ends it with a single stopper and attaches [IREGULARS] to the word
+	before them.
+	"""
+
+	sentence = sentence.replace(" </s>", "")
+
+	if sentence[-1:] in STOPPERS:
+		sentence = sentence.replace(sentence[-2:], sentence[-1:])
+	else:
+		#When sentence ends due to reaching maximum length
+		sentence = "".join([sentence, "."])
+
+	for r in IREGULARS:
+		sentence = sentence.replace((' ' + r), r)
+
+	return sentence
+
+
 def readFile(filepath):
 
 	"""
-	Reads a text file and returns a list of paragraphs
+	Lazily reads a text file and yields its lines one at a time
 
 	Input
 	------
@@ -375,13 +733,11 @@ def readFile(filepath):
 
 	Output
 	-------
-	text: a list of the sentences in the text file
+	text: a generator over the sentences in the text file
 	"""
 
 	with open(filepath, "r", encoding = "utf-8") as fp:
-		text = fp.readlines()
-	fp.close()
-	return text
+		yield from fp
 
 
 def addMacro(words):
@@ -410,40 +766,37 @@ def readDevelop(filepath):
 	with proper preprocessing
 
 	"""
-	with open(filepath, "r", encoding = "utf-8") as fp:
-		lines = fp.readlines()
-
 	ls = []
 
-	for line in lines:
+	for line in readFile(filepath):
 
 		words = line.strip().split()
 		words = addMacro(words)
 		ls.extend(words)
 
-	fp.close()
-
 	return ls
 
 
-def makeUnigrams(sentences):
+def encodeCorpus(sentences):
 
 	"""
-	Returns a dictionary of unigram tokens and the total number of
-	words in the corpus.
+	Maps every word of the corpus to an id, in order of first occurrence.
 
 	Input
 	------
-	sentences: a list of all sentences in the corpus
+	sentences: an iterable over all sentences in the corpus
 
 	Output
 	-------
-	tokens: a dictionary of all tokens and their counts in the corpus
-	numWords: an integer representing the total number of words in the corpus
+	wordIdx: a dictionary of all tokens and their ids
+	ids: an array of the ids of all words in the corpus, with the macros
+	added by [addMacro]
+	starts: an array of the offsets in [ids] where each sentence begins
 	"""
 
-	tokens = {}
-	numWords = 0
+	wordIdx = {}
+	ids = []
+	starts = []
 
 	for line in sentences:
 
@@ -451,142 +804,197 @@ def makeUnigrams(sentences):
 
 		words = addMacro(words)
 
-		n = len(words)
-		numWords += n
+		starts.append(len(ids))
+		ids.extend([wordIdx.setdefault(word, len(wordIdx)) for word in words])
 
-		for word in words:
+	return wordIdx, np.array(ids, np.int64), np.array(starts, np.int64)
 
-			if word not in tokens:
-				tokens[word] = 1
-			else:
-				tokens[word] += 1
 
-	return tokens, numWords
+def makeUnkIds(counts, unkId):
 
+	"""
+	Returns an array mapping every word id to its id after handling
+	unknowns, and the ids of the words removed as Unknowns: the first
+	[MAX_UNK] words with a count below [THRESHOLD].
 
-def makeBigrams(sentences):
+	Input
+	------
+	counts: an array of the counts of all word ids
+	unkId: the id of UNKNOWN_WORD
+	"""
+	rare = (counts < THRESHOLD) & (counts > 0)
+	rare[unkId] = False
+	removed = rare.nonzero()[0][:MAX_UNK]
+
+	unkMap = np.arange(len(counts))
+	unkMap[removed] = unkId
+
+	return unkMap, removed
+
+
+def countBigrams(ids, starts, numWords, endId = None):
 
 	"""
-	Returns a dictionary of bigrams and their counts
+	Returns the bigrams within the sentences of the corpus as a sorted
+	array of pair codes (first id * [numWords] + second id) and an array
+	of their counts. Bigrams starting with [endId] are not counted.
 
 	Input
 	------
-	sentences: a list of all sentences in the corpus
-
-	Output
-	-------
-	pairs: a dictionary of all bigrams and their counts in the corpus
+	ids, starts: the corpus as returned by [encodeCorpus]
+	numWords: the size of the vocabulary
+	endId: the id of END_OF_SENTENCE, if it is in the vocabulary
 	"""
+	firsts = ids[:-1]
+	seconds = ids[1:]
 
-	bi_separated = {}
+	#Pairs across two sentences end right before a sentence start
+	keep = np.ones(len(firsts), bool)
+	keep[starts[1:] - 1] = False
+	if endId is not None:
+		keep &= firsts != endId
 
-	for line in sentences:
+	codes, counts = np.unique(firsts[keep] * numWords + seconds[keep],
+		return_counts = True)
 
-		words = line.strip().split()
+	return codes, counts
 
-		words = addMacro(words)
 
-		for i in range(len(words[:-1])):
+class BigramStore:
 
-			preceedingWord = words[i]
-			currentWord = words[i+1]
+	"""
+	Bigram counts in a compact CSR layout: the bigrams of first word id f
+	are at positions [indptr[f], indptr[f+1]) of the uint32 arrays of
+	second word ids (sorted within each row) and of counts, 8 bytes per
+	bigram. Lookups are binary searches within a row.
+	"""
 
-			#Makes the separated case
-			if preceedingWord != END_OF_SENTENCE:
-				if preceedingWord not in bi_separated.keys():
-					bi_separated[preceedingWord] = {words[i+1]:1}
-				else:
-					if currentWord not in bi_separated[preceedingWord]:
-						bi_separated[preceedingWord][currentWord] = 1
-					else:
-						bi_separated[preceedingWord][words[i+1]] += 1
+	def __init__(self, indptr, seconds, counts):
 
-	return bi_separated
+		self._indptr = indptr
+		self._seconds = seconds
+		self._counts = counts
 
 
-def makeUnkUni(tokens):
+	@classmethod
+	def fromCodes(cls, codes, counts, numWords):
+		"""
+		Returns the store of the sorted pair [codes] (first id * [numWords]
+		+ second id, see [countBigrams]) and their [counts].
+		"""
+		indptr = np.searchsorted(codes, np.arange(numWords + 1) * numWords)
+		return cls(indptr, (codes % numWords).astype(np.uint32),
+			counts.astype(np.uint32))
 
-    """
-    Returns a Unigram dictonary that includes Unknown words and a
-	list of the words removed as Unknowns
 
-    Input
-	------
-	tokens: a dictionary of all tokens and their counts in corpus without
-    managing unknowns
+	@classmethod
+	def stack(cls, stores):
+		"""
+		Returns one store holding the rows of all [stores] one after the
+		other: row f of the i-th store becomes row f plus the number of
+		rows of the stores before it, and positions shift likewise.
+		"""
+		sizes = np.cumsum([0] + [len(store) for store in stores])
+		indptr = [store._indptr[:-1] + size for store, size in zip(stores, sizes)]
+		return cls(np.concatenate(indptr + [sizes[-1:]]),
+			np.concatenate([store._seconds for store in stores]),
+			np.concatenate([store._counts for store in stores]))
 
-	Output
-	-------
-	tokensUnk: a dictionary of all tokens and their counts in corpus after
-    handling unknowns
-    removedList: a list of words removed as Unkowns
-    """
-    tokensUnk = tokens.copy()
 
-    tokensUnk[UNKNOWN_WORD] = 0
-    removed = 0
-    threshold = 2  #words with frequency < [threshold] is replaced by Unknown
-    max = 20  #Maximum number of words replaced as Unknown
-    removedList = []
+	def __len__(self):
+		return len(self._seconds)
 
-    for k, v in list(tokensUnk.items()):
 
-        if v < threshold and k != UNKNOWN_WORD:
+	def numRows(self):
+		return len(self._indptr) - 1
 
-            removedList.append(k)
-            tokensUnk[UNKNOWN_WORD] += v
-            removed += 1
-            tokensUnk.pop(k, None)
 
-        if removed >= max:
-            break
+	def indptr(self):
+		return self._indptr
 
-    return tokensUnk, removedList
 
+	def seconds(self):
+		return self._seconds
 
-def makeUnkBi(sentences, removedList):
 
-	"""
-	A modified version of [makeBigrams] that handles Unknowns
+	def counts(self):
+		return self._counts
 
-	Input
-	------
-	sentences: a list of all sentences in the corpus
-    removedList: a list of words removed as unknowns
 
-	Output
-	-------
-	bi_separated: a dictionary of all bigrams and their counts in the corpus
-	"""
-	bi_separated = {}
+	def firsts(self):
+		"""
+		Returns the first word id of every bigram, in store order.
+		"""
+		return np.repeat(np.arange(self.numRows()), np.diff(self._indptr))
 
-	for line in sentences:
 
-		words = line.strip().split()
+	def find(self, firsts, seconds):
+		"""
+		Returns the positions of the bigrams ([firsts], [seconds]) (ids or
+		arrays of ids) in the store and whether each one was found there.
+		Positions of bigrams not found are valid but meaningless. All the
+		rows are binary searched together, one halving per step.
+		"""
+		firsts = np.asarray(firsts); seconds = np.asarray(seconds)
+		if len(self) == 0:
+			return np.zeros(firsts.shape, np.int64), np.zeros(firsts.shape, bool)
 
-		#appends the start word and end word symbols
-		words = addMacro(words)
+		lo = self._indptr[firsts].astype(np.int64)
+		hi = self._indptr[firsts + 1].astype(np.int64)
+		end = hi
 
-		for index, word in enumerate(words):
-			if word in removedList:
-				words[index] = UNKNOWN_WORD
+		active = lo < hi
+		while active.any():
+			mid = (lo + hi) // 2
+			less = self._seconds[np.minimum(mid, len(self) - 1)] < seconds
+			lo = np.where(active & less, mid + 1, lo)
+			hi = np.where(active & ~less, mid, hi)
+			active = lo < hi
 
-		for i in range(len(words[:-1])):
+		pos = np.minimum(lo, len(self) - 1)
+		return pos, (lo < end) & (self._seconds[pos] == seconds)
 
-			preceedingWord = words[i]
-			currentWord = words[i+1]
 
-			#Makes the separated case
-			if preceedingWord != END_OF_SENTENCE:
-				if preceedingWord not in bi_separated.keys():
-					bi_separated[preceedingWord] = {words[i+1]:1}
-				else:
-					if currentWord not in bi_separated[preceedingWord]:
-						bi_separated[preceedingWord][currentWord] = 1
-					else:
-						bi_separated[preceedingWord][words[i+1]] += 1
+	def lookup(self, firsts, seconds):
+		"""
+		Returns the counts of the bigrams ([firsts], [seconds]), with 0 for
+		bigrams not in the store.
+		"""
+		pos, found = self.find(firsts, seconds)
+		if len(self) == 0:
+			return np.zeros(pos.shape, np.int64)
+		return np.where(found, self._counts[pos], 0)
 
-	return bi_separated
+
+	def save(self, path):
+		"""
+		Writes the store as .npy files into the directory [path].
+		"""
+		os.makedirs(path, exist_ok = True)
+		for name in ('indptr', 'seconds', 'counts'):
+			np.save(os.path.join(path, name + '.npy'), getattr(self, '_' + name))
+
+
+	@classmethod
+	def load(cls, path, mmap = True):
+		"""
+		Returns the store saved at [path]; with [mmap] its arrays are
+		memory mapped read-only.
+		"""
+		mode = 'r' if mmap else None
+		return cls(*[np.load(os.path.join(path, name + '.npy'), mmap_mode = mode)
+			for name in ('indptr', 'seconds', 'counts')])
+
+
+def flattenLines(lines):
+	"""
+	The function returns all the words of [lines] (lists of words) as
+	one list and the array of offsets where each line starts.
+	"""
+	lengths = np.fromiter(map(len, lines), np.int64, len(lines))
+	starts = np.cumsum(lengths) - lengths
+	words = [word for line in lines for word in line]
+	return words, starts
 
 
 def readTest(filepath):
@@ -595,41 +1003,51 @@ def readTest(filepath):
 	of lines (list of words). Also added sentence begginer and stopper
 	tokens.
 	"""
-	lines = readFile(filepath)
-	unseenSpeech = []
+	return list(iterTest(filepath))
 
-	for line in lines:
-		words = line.strip().split()
-		words = addMacro(words)
-		unseenSpeech.append(words)
 
-	return unseenSpeech
+def iterTest(filepath):
+	"""
+	A generator version of [readTest] that yields one line (list of
+	words) at a time.
+	"""
+	for line in readFile(filepath):
+		words = line.strip().split()
+		yield addMacro(words)
 
 
 def seqProbability(model, line):
 	"""
 	The function takes in a BigramLM object and use it to calculate the
-	probability of a given [line] which is a list of words.
+	probability of a given [line] which is a list of words. It can
+	underflow to 0 on long lines; see [seqLogProbabilities].
 	"""
-	table = model.makeBigramProbTable()
-	for word in line:
-		if word == line[0]:
-			if word in table['<s>']:
-				prob = math.exp(table['<s>'][word])
-			else:
-				prob = model.calBiProbLap('<s>',word)
-			sequenceProb = prob
-			previous=word
-		else:
-            #find P(word|previous word)
-			if previous != '</s>':
-				if previous in table and word in table[previous]:
-					prob = math.exp(table[previous][word])
-				else:
-					prob = model.calBiProbLap(previous, word)
-				sequenceProb = sequenceProb * prob
-			previous = word
-	return sequenceProb
+	return math.exp(seqLogProbabilities(model, [line])[0])
+
+
+def seqLogProbabilities(model, lines):
+	"""
+	The function takes in a BigramLM object and returns an array with the
+	log probability of every line in [lines] (lists of words), computed
+	in one vectorized pass. The first word of a line is scored after
+	BEGINNING_OF_SENTENCE and each following word after the previous one,
+	except after END_OF_SENTENCE (see [BigramLM.calBiLogProbSeq]).
+	"""
+	words, starts = flattenLines(lines)
+	ids = model.wordIds(words)
+
+	previous = np.empty_like(ids)
+	previous[1:] = ids[:-1]
+	previous[starts[starts < len(ids)]] = model._wordIdx[BEGINNING_OF_SENTENCE]
+
+	keep = np.ones(len(ids), bool)
+	keep[1:] = np.array(words[:-1], object) != END_OF_SENTENCE
+	keep[starts[starts < len(ids)]] = True
+
+	logProbs = model.calBiLogProbSeq(previous[keep], ids[keep])
+	segments = np.searchsorted(starts, np.flatnonzero(keep), 'right') - 1
+
+	return np.bincount(segments, weights = logProbs, minlength = len(lines))
 
 
 def speechClassify(obamaModel,trumpModel,unseenSpeech):
@@ -637,22 +1055,131 @@ def speechClassify(obamaModel,trumpModel,unseenSpeech):
     The function takes in the obama and trump Bigram model and returns
     the speech classification of a given script in csv format.
     """
-    lineNumber = 0
-    prediction = None
-
-    with open('LMprediction.csv', 'w') as f:
-        writer = csv.writer(f)
-        writer.writerow(['Id', 'Prediction'])
-        for line in unseenSpeech:
-            obamaProb = seqProbability(obamaModel, line)
-            trumpProb = seqProbability(trumpModel, line)
-            if obamaProb > trumpProb:
-                prediction = 0
-            else:
-                prediction = 1
-            writer.writerow([lineNumber, prediction])
-            lineNumber += 1
-    f.close()
+    classifier = SpeechClassifier([obamaModel, trumpModel])
+    classifier.writeCsv(unseenSpeech, 'LMprediction.csv')
+
+
+class SpeechClassifier:
+
+	"""
+	Classifies lines among any number of BigramLM models, predicting the
+	model under which a line has the highest [seqLogProbabilities]. The
+	probability tables of all models are stacked over a shared vocabulary
+	so that a batch of lines is scored against every model in one
+	vectorized pass.
+	"""
+
+	def __init__(self, models):
+
+		"""
+		Input
+		-----
+		- models: a list of BigramLM models; predictions are their indexes
+		"""
+		self._wordIdx = {}
+		for model in models:
+			for word in model._words:
+				self._wordIdx.setdefault(word, len(self._wordIdx))
+		numShared = len(self._wordIdx)
+
+		#(models x shared vocabulary + 1) ids of every word in each model,
+		#plain and after handling unknowns. The last column is for words
+		#of no model, which a shared id of -1 picks.
+		self._ids = np.full((len(models), numShared + 1), -1)
+		self._idsUnk = np.empty((len(models), numShared + 1), np.int64)
+		for m, model in enumerate(models):
+			shared = np.array([self._wordIdx[word] for word in model._words])
+			self._ids[m, shared] = np.arange(len(model._words))
+			self._idsUnk[m] = model.wordIdsUnk(None, self._ids[m])
+
+		#The bigram stores of the models are stacked, so the first word ids
+		#of model m are offset by the vocabulary sizes of the models before it
+		sizes = np.array([len(model._words) for model in models])
+		self._offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]])[:, None]
+
+		self._bigrams = BigramStore.stack([model._bigrams for model in models])
+		self._logProbs = np.concatenate([model.logProbs() for model in models])
+		self._bigramsUnk = BigramStore.stack([model._bigramsUnk
+			for model in models])
+		self._logProbsLap = np.concatenate([model.logProbsLap()[0]
+			for model in models])
+		self._unseenLap = np.concatenate([model.logProbsLap()[1]
+			for model in models])
+
+		self._startId = self._wordIdx[BEGINNING_OF_SENTENCE]
+
+
+	def scoreBatch(self, lines):
+
+		"""
+		Returns the (models x lines) array of log probabilities of [lines]
+		(lists of words) under every model (see [seqLogProbabilities]).
+		"""
+		words, starts = flattenLines(lines)
+		ids = np.fromiter((self._wordIdx.get(word, -1) for word in words),
+			np.int64, len(words))
+		inside = starts[starts < len(ids)]
+
+		previous = np.empty_like(ids)
+		previous[1:] = ids[:-1]
+		previous[inside] = self._startId
+
+		keep = np.ones(len(ids), bool)
+		keep[1:] = np.array(words[:-1], object) != END_OF_SENTENCE
+		keep[inside] = True
+		previous = previous[keep]; ids = ids[keep]
+
+		#Unsmoothed probabilities of the bigrams seen in training
+		firsts = self._ids[:, previous]; seconds = self._ids[:, ids]
+		known = (firsts >= 0) & (seconds >= 0)
+		pos, found = self._bigrams.find(np.where(known, self._offsets + firsts, 0),
+			seconds)
+		found &= known
+
+		#Add-one smoothed probabilities of the others
+		firsts = self._offsets + self._idsUnk[:, previous]
+		posUnk, foundUnk = self._bigramsUnk.find(firsts, self._idsUnk[:, ids])
+		smoothed = np.where(foundUnk, self._logProbsLap[posUnk],
+			self._unseenLap[firsts])
+
+		logProbs = np.where(found, self._logProbs[pos], smoothed)
+
+		segments = np.searchsorted(starts, np.flatnonzero(keep), 'right') - 1
+		rows = np.arange(len(logProbs))[:, None] * len(lines)
+		scores = np.bincount((rows + segments).ravel(), weights = logProbs.ravel(),
+			minlength = len(logProbs) * len(lines))
+		return scores.reshape(len(logProbs), len(lines))
+
+
+	def classify(self, lines):
+
+		"""
+		Returns the array of indexes of the most probable model of each
+		line in [lines].
+		"""
+		return self.scoreBatch(lines).argmax(axis = 0)
+
+
+	def writeCsv(self, lines, filepath, batchSize = BATCH_SIZE):
+
+		"""
+		Classifies an iterable of [lines] (lists of words, see [readTest])
+		[batchSize] lines at a time and writes the predictions to a csv
+		file as each batch is scored.
+		"""
+		lines = iter(lines)
+		lineNumber = 0
+
+		with open(filepath, 'w') as f:
+			writer = csv.writer(f)
+			writer.writerow(['Id', 'Prediction'])
+
+			batch = list(islice(lines, batchSize))
+			while batch:
+				for prediction in self.classify(batch).tolist():
+					writer.writerow([lineNumber, prediction])
+					lineNumber += 1
+				batch = list(islice(lines, batchSize))
 
 
 def printUniTable(model, outputFile):
@@ -0,0 +1,142 @@
+"""
+This python script compiles the labelled entity spans of a training
+corpus into a token trie, the gazetteer of the baseline tagging model.
+Sentences are tagged by a leftmost-longest match scan over the trie.
+"""
+from collections import Counter
+
+LABEL = None    #Key of the entity class stored at the end node of a span
+
+
+class Gazetteer:
+
+	"""
+	A token trie of entity spans. Each node is a dictionary from the next
+	token to its child node; the node ending a span also maps LABEL to
+	the entity class of the span.
+	"""
+
+	def __init__(self):
+
+		self._root = {}
+
+
+	def add(self, tokens, label):
+		"""
+		Adds the span [tokens] (a sequence of tokens) with entity class
+		[label], replacing the class of a span already in the trie.
+		"""
+		node = self._root
+		for token in tokens:
+			node = node.setdefault(token, {})
+		node[LABEL] = label
+
+
+	def remove(self, tokens):
+		"""
+		Removes the entity class of the span [tokens], if it has one.
+		"""
+		node = self._root
+		for token in tokens:
+			node = node.get(token)
+			if node is None:
+				return
+		node.pop(LABEL, None)
+
+
+	def longestMatch(self, tokens, start):
+		"""
+		Returns (end, label) for the longest span in the trie that starts
+		at position [start] of [tokens], or None if no span starts there.
+		"""
+		node = self._root
+		match = None
+		for i in range(start, len(tokens)):
+			node = node.get(tokens[i])
+			if node is None:
+				break
+			if LABEL in node:
+				match = (i + 1, node[LABEL])
+		return match
+
+
+	def matches(self, tokens):
+		"""
+		A generator that scans [tokens] left to right and yields the
+		(start, end, label) of the leftmost-longest, non-overlapping spans.
+		"""
+		i = 0
+		while i < len(tokens):
+			match = self.longestMatch(tokens, i)
+			if match is None:
+				i += 1
+			else:
+				end, label = match
+				yield i, end, label
+				i = end
+
+
+	def assignTags(self, tokens):
+		"""
+		A function that returns the BIO tags of [tokens], with 'O' for
+		every token outside a matched span.
+		"""
+		tags = ['O'] * len(tokens)
+		for start, end, label in self.matches(tokens):
+			tags[start] = 'B-' + label
+			for i in range(start + 1, end):
+				tags[i] = 'I-' + label
+		return tags
+
+
+def build(readRecords):
+	"""
+	A function that compiles a gazetteer from a training corpus. The
+	argument returns a fresh iterator over its records each time it is
+	called, since the corpus is read twice: once to collect the entity
+	spans and their most frequent class, and once to count how often
+	each span occurs in the corpus without being that entity. Spans
+	that are more often not an entity are dropped.
+	"""
+	classes = {}
+	for tokens, _, tags in readRecords():
+		for start, end, label in entitySpans(tags):
+			span = tuple(tokens[start:end])
+			classes.setdefault(span, Counter())[label] += 1
+
+	gazetteer = Gazetteer()
+	for span, counts in classes.items():
+		gazetteer.add(span, counts.most_common(1)[0][0])
+
+	misses = Counter()
+	for tokens, _, tags in readRecords():
+		gold = set(entitySpans(tags))
+		for start, end, label in gazetteer.matches(tokens):
+			if (start, end, label) not in gold:
+				misses[tuple(tokens[start:end])] += 1
+
+	for span, count in misses.items():
+		if count > sum(classes[span].values()):
+			gazetteer.remove(span)
+
+	return gazetteer
+
+
+def entitySpans(tags):
+	"""
+	A function that returns the (start, end, label) of every entity in a
+	list of BIO tags. An 'I' tag that does not continue an entity of the
+	same class starts a new one.
+	"""
+	spans = []
+	start = None; label = None
+	for i, tag in enumerate(tags + ['O']):
+		bioTag = tag[:1]
+		if bioTag == 'I' and start is not None and tag[2:] == label:
+			continue
+		if start is not None:
+			spans.append((start, i, label))
+			start = None; label = None
+		if bioTag != 'O':
+			start = i; label = tag[2:]
+	return spans
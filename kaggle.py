@@ -1,219 +1,142 @@
 """
 This python script generates the csv files for the tagging models.
 """
-import preprocess
+import parallel
 import baseline
 import HMM
 import MEMM
 import csv
+import shutil
+import tempfile
 
 TRAIN = "train.txt"
 TEST = "test.txt"
+WORKERS = None  #Number of tagging processes, None uses all cores
+MEMM_MODEL = "MEMMmodel"    #Directory of the saved MEMM model
+TYPES = ('PER', 'LOC', 'ORG', 'MISC')
+SPOOL_SIZE = 1 << 20    #Characters of a type's spans kept in memory
 
 
-def BLdebug(tags):
-    """
-    A debug function for mistakenly assigned 'I' tags:
-        1) 'I' tag assigned without a leading 'B' tag
-        2) Inconsistant tag class
-    For such cases, replace 'I' with 'B'.
-    """
-    preClass = None; NEcontinues = False
-    for i in range(len(tags)):
-        tag = tags[i]
-        bioTag = tag[:1]
-        if bioTag == 'B':
-            preClass = tag[2:]
-            NEcontinues = True
-        elif bioTag == 'I':
-            curClass = tag[2:]
-            if (not NEcontinues) or (curClass != preClass):
-                #Error 1) or 2)
-                tags[i] = 'B' + tag[1:]
-                preClass = curClass
-                NEcontinues = True
-        elif bioTag == 'O':
-            preClass = None
-            NEcontinues = False
-    return tags
-
-
-def baselineClassify(train, test):
+def baselineClassify(train, test, workers = 1):
     """
     The function returns the tagging prediction by the baseline system as
-    a dictionary.
+    a stream of (type, span) pairs (see [extractSpans]). The test file is
+    tagged by [workers] processes.
     """
     model = baseline.Baseline(train)
-    lines = preprocess.readFile(test)
-    prediction = {'PER': [], 'LOC': [], 'ORG': [], 'MISC': []}
-    lineNum = 1
-
-    for line in lines:
-        if (lineNum % 3) == 1:
-            #Line with Tokens
-            tokens = line.strip().split()
-            tags = BLdebug(model.assignTags(tokens))
-        elif (lineNum % 3) == 0:
-            #Line with indexes
-            indexes = line.strip().split()
-            preClass = None; firstIdx = None; lastIdx = None
-            NEcontinues = False
-
-            for i in range(len(tags)):
-                bioTag = tags[i][:1]
-
-                if bioTag == 'B':
-                    if NEcontinues:
-                        #Previous tag ends
-                        prediction[preClass].append(firstIdx + '-' + lastIdx)
-                    preClass = tags[i][2:]
-                    firstIdx = indexes[i]; lastIdx = indexes[i]
-                    NEcontinues = True
-
-                elif bioTag == 'I':
-                    curClass = tags[i][2:]
-                    assert NEcontinues and curClass == preClass
-                    lastIdx = indexes[i]
-
-                else:   # bioTag == 'O'
-                    if NEcontinues:
-                        prediction[preClass].append(firstIdx + '-' + lastIdx)
-                    preClass = None;
-                    firstIdx = None; lastIdx = None
-                    NEcontinues = False
-
-        lineNum += 1
-
-    return prediction
-
-
-def HMMClassify(train, trainNE, test):
+    tagged = parallel.tagFile(model, baseline.tagRecords, test, workers)
+    return extractSpans((tags, record[2]) for record, tags in tagged)
+
+
+def HMMClassify(train, test, workers = 1):
     """
     The function returns the tagging prediction by the HMM system as
-    a dictionary.
+    a stream of (type, span) pairs (see [extractSpans]). The test file is
+    tagged by [workers] processes.
     """
-    model = HMM.HMM(train, trainNE)
-    lines = preprocess.readFile(test)
-    prediction = {'PER': [], 'LOC': [], 'ORG': [], 'MISC': []}
-    lineNum = 1
-
-    for line in lines:
-        if (lineNum % 3) == 1:
-            #Line with Tokens
-            tags = model.assignTags(line)
-        elif (lineNum % 3) == 0:
-            #Line with indexes
-            indexes = line.strip().split()
-            preClass = None; firstIdx = None; lastIdx = None
-            NEcontinues = False
-
-            for i in range(len(tags)):
-                tag = tags[i]
-                if tag == 'O':
-                    if NEcontinues:
-                        #Previous tag ends
-                        prediction[preClass].append(firstIdx + '-' + lastIdx)
-                    preClass = None
-                    firstIdx = None; lastIdx = None
-                    NEcontinues = False
-
-                else:
-                    if NEcontinues:
-                        if tag != preClass:
-                            #Previous tag ends, new Tag begins
-                            prediction[preClass].append(firstIdx + '-' + lastIdx)
-                            preClass = tag
-                            firstIdx = indexes[i]; lastIdx = indexes[i]
-                        else:
-                            #Previous tag continues
-                            lastIdx = indexes[i]
-                    else:
-                        #New tag begins
-                        preClass = tag
-                        firstIdx = indexes[i]; lastIdx = indexes[i]
-                        NEcontinues = True
-        lineNum += 1
-    return prediction
-
-
-def MEMMClassify(train, test):
+    model = HMM.HMM(train)
+    tagged = parallel.tagFile(model, HMM.tagRecords, test, workers)
+    return extractSpans((bioTags(HMM.addBio, tags), record[2])
+    for record, tags in tagged)
+
+
+def MEMMClassify(train, test, workers = 1, modelPath = None):
     """
     The function returns the tagging prediction by the MEMM system as
-    a dictionary.
+    a stream of (type, span) pairs (see [extractSpans]). The test file is
+    tagged by [workers] processes. The trained model is reused from
+    [modelPath] if it was saved there.
+    """
+    model = MEMM.getModel(train, modelPath)
+    tagged = parallel.tagFile(model, MEMM.tagRecords, test, workers)
+    return extractSpans((bioTags(MEMM.addBio, tags), record[2])
+    for record, tags in tagged)
+
+
+def bioTags(addBio, tags):
+    """
+    The function adds the B and I prefixes to a list of class tags in
+    place with [addBio] and returns it.
+    """
+    addBio(tags)
+    return tags
+
+
+def extractSpans(tagged):
     """
-    model = MEMM.MEMM(train)
-    lines = preprocess.readFile(test)
-    prediction = {'PER': [], 'LOC': [], 'ORG': [], 'MISC': []}
-    lineNum = 1
-
-    for line in lines:
-        if (lineNum % 3) == 1:
-            #Line with Tokens
-            sentence = line
-
-        elif (lineNum % 3) == 2:
-            tags = model.assignTags(sentence, line)
-
-        else:
-            #Line with indexes
-            indexes = line.strip().split()
-            preClass = None; firstIdx = None; lastIdx = None
-            NEcontinues = False
-
-            for i in range(len(tags)):
-                tag = tags[i]
-                if tag == 'O':
-                    if NEcontinues:
-                        #Previous tag ends
-                        prediction[preClass].append(firstIdx + '-' + lastIdx)
-                    preClass = None
-                    firstIdx = None; lastIdx = None
-                    NEcontinues = False
-
-                else:
-                    if NEcontinues:
-                        if tag != preClass:
-                            #Previous tag ends, new Tag begins
-                            prediction[preClass].append(firstIdx + '-' + lastIdx)
-                            preClass = tag
-                            firstIdx = indexes[i]; lastIdx = indexes[i]
-                        else:
-                            #Previous tag continues
-                            lastIdx = indexes[i]
-                    else:
-                        #New tag begins
-                        preClass = tag
-                        firstIdx = indexes[i]; lastIdx = indexes[i]
-                        NEcontinues = True
-        lineNum += 1
-    return prediction
-
-
-def writeKaggle(prediction, filepath):
+    A generator that consumes a stream of (BIO tags, indexes) sentences
+    and yields the (type, "first-last") index span of every named entity.
+    An entity still open at the end of a sentence is not yielded.
+    """
+    for tags, indexes in tagged:
+        preClass = None; firstIdx = None; lastIdx = None
+        NEcontinues = False
+
+        for i in range(len(tags)):
+            bioTag = tags[i][:1]
+
+            if bioTag == 'B':
+                if NEcontinues:
+                    #Previous tag ends
+                    yield preClass, firstIdx + '-' + lastIdx
+                preClass = tags[i][2:]
+                firstIdx = indexes[i]; lastIdx = indexes[i]
+                NEcontinues = True
+
+            elif bioTag == 'I':
+                curClass = tags[i][2:]
+                assert NEcontinues and curClass == preClass
+                lastIdx = indexes[i]
+
+            else:   # bioTag == 'O'
+                if NEcontinues:
+                    yield preClass, firstIdx + '-' + lastIdx
+                preClass = None;
+                firstIdx = None; lastIdx = None
+                NEcontinues = False
+
+
+def writeKaggle(spans, filepath):
     """
-    Function that writes the prediction (dictionary) of a tagging LM
-    into a csv file follwing the Kaggle format.
+    Function that writes a stream of (type, span) predictions of a
+    tagging LM into a csv file follwing the Kaggle format. The spans of
+    each type are appended to their own buffer, which stays in memory up
+    to SPOOL_SIZE characters and then moves to a temporary file; the
+    buffers are then copied into their csv rows.
     """
-    with open(filepath, 'w') as f:
-        writer = csv.writer(f)
-        writer.writerow(['Type', 'Prediction'])
-        for type, indexes in prediction.items():
-            str = ""
-            for index in indexes:
-                str += ' ' + index
-            writer.writerow([type, str.strip()])
-    f.close()
+    buffers = {type: tempfile.SpooledTemporaryFile(SPOOL_SIZE, 'w+')
+    for type in TYPES}
+    try:
+        for type, span in spans:
+            buffer = buffers[type]
+            if buffer.tell():
+                buffer.write(' ')
+            buffer.write(span)
+
+        with open(filepath, 'w', newline = '') as f:
+            writer = csv.writer(f)
+            writer.writerow(['Type', 'Prediction'])
+            #Spans are index ranges, which never need csv quoting, so
+            #each row is streamed from its buffer as is
+            for type, buffer in buffers.items():
+                f.write(type + ',')
+                buffer.seek(0)
+                shutil.copyfileobj(buffer, f)
+                f.write(writer.dialect.lineterminator)
+    finally:
+        for buffer in buffers.values():
+            buffer.close()
 
 
 def main():
     print("Generating csv file...")
-    #prediction = baselineClassify(TRAIN, TEST)
+    #prediction = baselineClassify(TRAIN, TEST, WORKERS)
     #writeKaggle(prediction, "BLpredict.csv")
 
-    #prediction = HMMClassify(TRAIN, 'trainNE.txt', TEST)
+    #prediction = HMMClassify(TRAIN, TEST, WORKERS)
     #writeKaggle(prediction, "HMMpredict.csv")
 
-    prediction = MEMMClassify(TRAIN, TEST)
+    prediction = MEMMClassify(TRAIN, TEST, WORKERS, MEMM_MODEL)
     writeKaggle(prediction, "MEMMpredict.csv")
 
 
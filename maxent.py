@@ -0,0 +1,334 @@
+"""
+This python script trains maximum entropy (multinomial logistic
+regression) classifiers over sparse binary features with NumPy. It
+replaces nltk's MaxentClassifier for the MEMM model.
+
+Instances are rows of a CSR matrix (indptr, indices) of feature ids,
+and the weights are a (features x labels) matrix.
+"""
+import multiprocessing as mp
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+MAX_ITER = 100
+L2 = 1e-6           #Strength of the L2 (gaussian prior) penalty
+TOL = 1e-6          #Relative objective decrease that counts as converged
+WINDOW = 5          #Iterations the objective decrease is averaged over
+HISTORY = 10        #Number of correction pairs kept by L-BFGS
+PATIENCE = 10       #Iterations without held-out improvement before stopping
+
+
+def fit(indptr, indices, y, numFeatures, numLabels, maxIter = MAX_ITER,
+l2 = L2, workers = 1, tol = TOL, maxTime = None, heldOut = None,
+patience = PATIENCE, log = print, init = None):
+    """
+    A function that returns the weights maximizing the L2 penalized
+    log-likelihood of the instances in the CSR matrix ([indptr],
+    [indices]) with labels [y], using L-BFGS. With [workers] > 1 the
+    instances are sharded across that many processes.
+
+    Training stops after [maxIter] iterations, when the objective
+    decreases by less than [tol] (relative), after [maxTime] seconds, or
+    when the accuracy on the [heldOut] (indptr, indices, y) instances has
+    not improved for [patience] iterations; the weights with the best
+    held-out accuracy are then returned. Per-iteration telemetry is
+    written with [log] (None for silence).
+
+    Training warm starts from [init], the weights of a previous model;
+    its rows are the first features and any later features start at 0.
+    """
+    weights = np.zeros((numFeatures, numLabels))
+    if init is not None:
+        weights[:len(init)] = init
+    monitor = Monitor(len(y), maxTime, heldOut, patience, log)
+
+    if workers == 1:
+        def fun(weights):
+            return objective(weights, indptr, indices, y, l2)
+        weights = minimize(monitor.count(fun), weights, maxIter, tol, monitor)
+    else:
+        with ParallelObjective(indptr, indices, y, weights.shape, l2,
+        workers) as fun:
+            weights = minimize(monitor.count(fun), weights, maxIter, tol,
+            monitor)
+
+    return monitor.best(weights)
+
+
+class Monitor:
+
+    """
+    Training telemetry and early stopping for [fit]. Called after every
+    L-BFGS iteration; returns True when training should stop.
+    """
+
+    def __init__(self, numInstances, maxTime, heldOut, patience, log):
+
+        self._n = numInstances
+        self._maxTime = maxTime
+        self._heldOut = heldOut
+        self._patience = patience
+        self._log = log or (lambda line: None)
+        self._start = time.perf_counter()
+        self._evaluations = 0
+        self._bestWeights = None; self._bestAccuracy = -1.0; self._bestIt = 0
+        self.history = []
+
+        self._log("      Iteration     Objective   Held-out   Seconds   Instances/s")
+        self._log("      ---------------------------------------------------------")
+
+
+    def count(self, fun):
+        """
+        Returns [fun] wrapped to count its evaluations.
+        """
+        def counted(weights):
+            self._evaluations += 1
+            return fun(weights)
+        return counted
+
+
+    def __call__(self, it, weights, loss):
+        seconds = time.perf_counter() - self._start
+        throughput = self._n * self._evaluations / max(seconds, 1e-9)
+        accuracy = None
+        if self._heldOut is not None:
+            accuracy = heldOutAccuracy(weights, *self._heldOut)
+
+        self.history.append({'iteration': it, 'objective': loss,
+        'accuracy': accuracy, 'seconds': seconds, 'throughput': throughput})
+        self._log("%15d %13.5f %10s %9.1f %13.0f" % (it, loss,
+        '-' if accuracy is None else '%.4f' % accuracy, seconds, throughput))
+
+        if self._maxTime is not None and seconds >= self._maxTime:
+            return True
+        if accuracy is not None:
+            if accuracy > self._bestAccuracy:
+                self._bestWeights = weights; self._bestAccuracy = accuracy
+                self._bestIt = it
+            elif it - self._bestIt >= self._patience:
+                return True
+        return False
+
+
+    def best(self, weights):
+        """
+        Returns the weights with the best held-out accuracy, or [weights]
+        when there is no held-out set.
+        """
+        if self._bestWeights is None:
+            return weights
+        return self._bestWeights
+
+
+def heldOutAccuracy(weights, indptr, indices, y):
+    """
+    A function that returns the fraction of the instances whose most
+    probable label is their label [y].
+    """
+    scores = np.add.reduceat(weights[indices], indptr[:-1])
+    return (scores.argmax(axis = 1) == y).mean()
+
+
+def objective(weights, indptr, indices, y, l2):
+    """
+    A function that returns the mean negative log-likelihood (plus the
+    L2 penalty) of the instances and its gradient with respect to
+    [weights].
+    """
+    loss, grad = partialObjective(weights, indptr, indices, y)
+    return penalize(loss, grad, weights, len(y), l2)
+
+
+def partialObjective(weights, indptr, indices, y):
+    """
+    A function that returns the summed negative log-likelihood of the
+    instances and its gradient X^T (P - Y). Every row of the CSR matrix
+    must hold at least one feature.
+    """
+    rows = np.arange(len(y))
+
+    scores = np.add.reduceat(weights[indices], indptr[:-1])
+    logP = scores - logSumExp(scores, axis = 1)[:, None]
+    loss = -logP[rows, y].sum()
+
+    delta = np.exp(logP)
+    delta[rows, y] -= 1
+    instance = np.repeat(rows, np.diff(indptr))
+    grad = np.empty_like(weights)
+    for k in range(weights.shape[1]):
+        grad[:, k] = np.bincount(indices, weights = delta[instance, k],
+        minlength = len(weights))
+
+    return loss, grad
+
+
+def penalize(loss, grad, weights, n, l2):
+    """
+    A function that turns a summed loss and gradient over [n] instances
+    into the mean plus the L2 penalty.
+    """
+    loss = loss / n + 0.5 * l2 * np.vdot(weights, weights)
+    return loss, grad / n + l2 * weights
+
+
+class ParallelObjective:
+
+    """
+    The objective of [fit] computed by worker processes, each holding
+    one contiguous shard of the instances. The weights are broadcast
+    and the partial gradients gathered through shared memory; only the
+    partial losses go through the pipes.
+    """
+
+    def __init__(self, indptr, indices, y, shape, l2, workers):
+
+        self._n = len(y)
+        self._l2 = l2
+        size = int(np.prod(shape)) * 8
+        self._weightsMem = shared_memory.SharedMemory(create = True, size = size)
+        self._gradsMem = shared_memory.SharedMemory(create = True,
+        size = size * workers)
+        self._weights = np.ndarray(shape, buffer = self._weightsMem.buf)
+        self._grads = np.ndarray((workers,) + shape, buffer = self._gradsMem.buf)
+
+        self._pipes = []; self._processes = []
+        bounds = np.linspace(0, len(y), workers + 1).astype(int)
+        for slot in range(workers):
+            start, end = bounds[slot], bounds[slot + 1]
+            shard = (indptr[start:end + 1] - indptr[start],
+            indices[indptr[start]:indptr[end]], y[start:end])
+            parent, child = mp.Pipe()
+            process = mp.Process(target = shardWorker, args = (child,
+            self._weightsMem.name, self._gradsMem.name, shape, slot, workers,
+            shard),
+            daemon = True)
+            process.start()
+            self._pipes.append(parent); self._processes.append(process)
+
+
+    def __call__(self, weights):
+        self._weights[:] = weights
+        for pipe in self._pipes:
+            pipe.send(True)
+        loss = sum(pipe.recv() for pipe in self._pipes)
+        return penalize(loss, self._grads.sum(axis = 0), weights, self._n,
+        self._l2)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        for pipe in self._pipes:
+            pipe.send(False)
+        for process in self._processes:
+            process.join()
+        del self._weights, self._grads
+        for mem in (self._weightsMem, self._gradsMem):
+            mem.close()
+            mem.unlink()
+
+
+def shardWorker(pipe, weightsName, gradsName, shape, slot, workers, shard):
+    """
+    The loop of a [ParallelObjective] worker: on every request it reads
+    the shared weights, writes the gradient of its [shard] into its slot
+    of the shared gradients and sends back its summed loss.
+    """
+    weightsMem = shared_memory.SharedMemory(name = weightsName)
+    gradsMem = shared_memory.SharedMemory(name = gradsName)
+    weights = np.ndarray(shape, buffer = weightsMem.buf)
+    grads = np.ndarray((workers,) + shape, buffer = gradsMem.buf)
+    indptr, indices, y = shard
+
+    while pipe.recv():
+        loss, grads[slot] = partialObjective(weights, indptr, indices, y)
+        pipe.send(loss)
+
+    del weights, grads
+    weightsMem.close(); gradsMem.close()
+
+
+def minimize(fun, x, maxIter = MAX_ITER, tol = TOL, callback = None):
+    """
+    A function that minimizes the smooth convex function [fun] (which
+    returns the value and the gradient) from the starting point [x] with
+    L-BFGS and a backtracking line search. [callback(iteration, x, f)] is
+    called after every iteration and stops the search by returning True.
+    """
+    f, g = fun(x)
+    sList = []; yList = []
+    values = [f]
+
+    for it in range(1, maxIter + 1):
+        direction = -twoLoop(g, sList, yList)
+        slope = np.vdot(g, direction)
+        if slope >= 0:
+            #Not a descent direction, restart from steepest descent
+            sList.clear(); yList.clear()
+            direction = -g; slope = -np.vdot(g, g)
+
+        step = 1.0 if sList else 1.0 / max(np.sqrt(-slope), 1.0)
+        while True:
+            xNew = x + step * direction
+            fNew, gNew = fun(xNew)
+            if fNew <= f + 1e-4 * step * slope or step < 1e-10:
+                break
+            step *= 0.5
+
+        s = xNew - x; yDiff = gNew - g
+        if np.vdot(s, yDiff) > 1e-10:
+            sList.append(s); yList.append(yDiff)
+            if len(sList) > HISTORY:
+                sList.pop(0); yList.pop(0)
+
+        #Converged once the average relative decrease over the last
+        #WINDOW iterations is below [tol], so that a single short step
+        #(e.g. the first one of a warm start) does not stop the search
+        values.append(fNew)
+        converged = (len(values) > WINDOW and values[-WINDOW-1] - fNew
+        <= tol * WINDOW * max(abs(fNew), 1.0))
+        x, f, g = xNew, fNew, gNew
+        if callback is not None and callback(it, x, f):
+            break
+        if converged:
+            break
+
+    return x
+
+
+def twoLoop(g, sList, yList):
+    """
+    A function that returns the L-BFGS approximation of the inverse
+    hessian times [g] from the stored correction pairs.
+    """
+    q = g.copy()
+    alphas = []
+    for s, yDiff in zip(reversed(sList), reversed(yList)):
+        rho = 1.0 / np.vdot(yDiff, s)
+        alpha = rho * np.vdot(s, q)
+        q -= alpha * yDiff
+        alphas.append((rho, alpha))
+
+    if sList:
+        q *= np.vdot(sList[-1], yList[-1]) / np.vdot(yList[-1], yList[-1])
+
+    for (s, yDiff), (rho, alpha) in zip(zip(sList, yList), reversed(alphas)):
+        beta = rho * np.vdot(yDiff, q)
+        q += (alpha - beta) * s
+
+    return q
+
+
+def logSumExp(scores, axis = -1):
+    """
+    A function that returns log(sum(exp(scores))) along [axis] without
+    overflowing.
+    """
+    top = scores.max(axis = axis, keepdims = True)
+    return (top + np.log(np.exp(scores - top).sum(axis = axis,
+    keepdims = True))).squeeze(axis)
@@ -0,0 +1,72 @@
+"""
+This python script runs the tagging models over a 3-line test file with
+a pool of worker processes. The trained model is shipped to each worker
+once and the tagged records are returned in their original order.
+"""
+import os
+from collections import deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+
+import preprocess
+
+CHUNK_SIZE = 500
+
+_model = None   #The model of a worker process, set by [initWorker]
+
+
+def readChunks(corpus, chunkSize = CHUNK_SIZE):
+    """
+    A generator that streams a 3-line corpus (a path or parsed records,
+    see [preprocess.iterRecords]) and yields lists of at most
+    [chunkSize] records.
+    """
+    records = preprocess.iterRecords(corpus)
+    chunk = list(islice(records, chunkSize))
+    while chunk:
+        yield chunk
+        chunk = list(islice(records, chunkSize))
+
+
+def initWorker(model):
+    """
+    Pool initializer that stores the trained [model] in the worker.
+    """
+    global _model
+    _model = model
+
+
+def tagChunk(tagFn, chunk):
+    """
+    Tags a chunk of records inside a worker with its stored model.
+    """
+    return tagFn(_model, chunk)
+
+
+def tagFile(model, tagFn, corpus, workers = 1, chunkSize = CHUNK_SIZE):
+    """
+    A generator that yields (record, tags) for every record of [corpus]
+    (a file path or parsed records), in order. [tagFn(model, records)] must be a module
+    level function returning the tags of each record. With [workers]
+    other than 1 the chunks are tagged in a process pool (None uses all
+    cores); at most two chunks per worker are in flight at a time.
+    """
+    chunks = readChunks(corpus, chunkSize)
+
+    if workers == 1:
+        for chunk in chunks:
+            yield from zip(chunk, tagFn(model, chunk))
+        return
+
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(workers, initializer = initWorker,
+    initargs = (model,)) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append((chunk, pool.submit(tagChunk, tagFn, chunk)))
+            if len(pending) > 2 * workers:
+                chunk, future = pending.popleft()
+                yield from zip(chunk, future.result())
+        while pending:
+            chunk, future = pending.popleft()
+            yield from zip(chunk, future.result())
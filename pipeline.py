@@ -0,0 +1,189 @@
+"""
+This python script is the command line entry point of the tagging
+models. The train and test corpora are parsed once and shared by every
+selected model, which is then trained (or loaded) and run over them.
+
+    python pipeline.py evaluate --train tempTrain.txt --test tempTest.txt
+    python pipeline.py tag --models HMM MEMM --workers 4
+
+[evaluate] reports the accuracy of each model on a labelled test set,
+[tag] writes the Kaggle csv file of each model. Both report the time
+spent in every stage.
+"""
+import argparse
+import os
+import time
+
+import preprocess
+import parallel
+import baseline
+import HMM
+import MEMM
+import kaggle
+
+EVAL_TRAIN = "tempTrain.txt"    #Labelled corpora [evaluate] defaults to
+EVAL_TEST = "tempTest.txt"
+
+
+def buildBaseline(train, args):
+    return baseline.Baseline(train)
+
+
+def buildHMM(train, args):
+    return HMM.HMM(train)
+
+
+def buildMEMM(train, args):
+    return MEMM.getModel(train, args.memm_model)
+
+
+def isSaved(name, args):
+    """
+    A function that returns whether the [name] model is loaded from a
+    saved model rather than trained on the train corpus.
+    """
+    return (name == 'MEMM' and args.memm_model is not None
+    and os.path.isdir(args.memm_model))
+
+
+#name: (build(train records, args), tagRecords, addBio or None, csv file)
+MODELS = {
+    'baseline': (buildBaseline, baseline.tagRecords, None, "BLpredict.csv"),
+    'HMM': (buildHMM, HMM.tagRecords, HMM.addBio, "HMMpredict.csv"),
+    'MEMM': (buildMEMM, MEMM.tagRecords, MEMM.addBio, "MEMMpredict.csv"),
+}
+
+
+class Timings:
+
+    """
+    The wall clock time of each stage of a run, in the order they ran.
+    """
+
+    def __init__(self):
+
+        self._stages = []
+
+
+    def run(self, stage, fn, *args):
+        """
+        Returns fn(*args) and records the seconds it took under [stage].
+        """
+        start = time.perf_counter()
+        result = fn(*args)
+        self._stages.append((stage, time.perf_counter() - start))
+        return result
+
+
+    def report(self):
+        print("\n%-40s %10s" % ("Stage", "Seconds"))
+        for stage, seconds in self._stages:
+            print("%-40s %10.2f" % (stage, seconds))
+        total = sum(seconds for _, seconds in self._stages)
+        print("%-40s %10.2f" % ("total", total))
+
+
+def tagCorpus(name, model, test, workers):
+    """
+    A generator that yields the (record, BIO tags) pairs of the records
+    in [test] tagged by the [name] model.
+    """
+    _, tagRecords, addBio, _ = MODELS[name]
+    for record, tags in parallel.tagFile(model, tagRecords, test, workers):
+        if addBio is not None:
+            addBio(tags)
+        yield record, tags
+
+
+def checkLabelled(records, filepath):
+    """
+    A function that exits with an error message when the third line of
+    a record in [records] is not BIO tags (e.g. the indexes of a Kaggle
+    test file), before any model is built.
+    """
+    for _, _, tags in records:
+        for tag in tags:
+            if tag != 'O' and tag[:2] not in ('B-', 'I-'):
+                raise SystemExit("error: %s is not labelled: "
+                "%r is not a BIO tag" % (filepath, tag))
+
+
+def accuracy(tagged):
+    """
+    A function that returns the number of correct tags and the number
+    of tags of (record, tags) pairs whose records hold the gold tags.
+    """
+    correct = 0; total = 0
+    for record, tags in tagged:
+        answers = record[2]
+        correct += sum(tag == answer for tag, answer in zip(tags, answers))
+        total += len(answers)
+    return correct, total
+
+
+def writePredictions(tagged, filepath):
+    kaggle.writeKaggle(kaggle.extractSpans((tags, record[2])
+    for record, tags in tagged), filepath)
+
+
+def run(args):
+    """
+    A function that runs the [args.command] over every selected model.
+    """
+    timings = Timings()
+    train = timings.run("parse " + args.train, preprocess.asRecords,
+    args.train)
+    test = timings.run("parse " + args.test, preprocess.asRecords, args.test)
+    if args.command == 'evaluate':
+        checkLabelled(test, args.test)
+
+    for name in args.models:
+        build, _, _, csvFile = MODELS[name]
+        stage = " load" if isSaved(name, args) else " train"
+        model = timings.run(name + stage, build, train, args)
+        #Tagging is streamed into the accuracy count or the csv writer
+        tagged = tagCorpus(name, model, test, args.workers)
+
+        if args.command == 'evaluate':
+            correct, total = timings.run(name + " tag", accuracy, tagged)
+            print("%s gets %d correct tags out of %d, accuracy %.4f"
+            % (name, correct, total, correct / total))
+        else:
+            timings.run(name + " tag and write " + csvFile,
+            writePredictions, tagged, csvFile)
+
+    timings.report()
+
+
+def parseArgs(argv = None):
+    parser = argparse.ArgumentParser(description = "Train and run the NER "
+    "tagging models.")
+    parser.add_argument('command', choices = ('tag', 'evaluate'))
+    parser.add_argument('--models', nargs = '+', choices = list(MODELS),
+    default = list(MODELS))
+    parser.add_argument('--train', help = "default %s for tag, %s for "
+    "evaluate" % (kaggle.TRAIN, EVAL_TRAIN))
+    parser.add_argument('--test', help = "default %s for tag, %s for "
+    "evaluate" % (kaggle.TEST, EVAL_TEST))
+    parser.add_argument('--workers', type = int, default = 1,
+    help = "number of tagging processes, 0 uses all cores")
+    parser.add_argument('--memm-model', default = None,
+    help = "directory the MEMM model is loaded from (ignoring --train) if "
+    "it exists, or saved to after training")
+    args = parser.parse_args(argv)
+    args.workers = args.workers or None
+    if args.command == 'evaluate':
+        args.train = args.train or EVAL_TRAIN
+        args.test = args.test or EVAL_TEST
+    else:
+        args.train = args.train or kaggle.TRAIN
+        args.test = args.test or kaggle.TEST
+    return args
+
+
+def main():
+    run(parseArgs())
+
+
+if __name__ == "__main__":
+    main()
@@ -4,110 +4,197 @@ and baseline system models.
 
 Authors: Sena Katako, Vivian Gao, Xianyi Han
 """
+import numpy as np
+
 PRETOKEN = '<t>'
 PRENE = '<n>'
 UNK = '<UNK>'
+BIAS = '<bias>'
+UNSEEN = '<unseen>'
+#Field prefixes of the MEMM feature templates <preToken, preNE, curToken, curPOS>
+TEMPLATES = ('w-1=', 'ne-1=', 'w=', 'pos=')
+TAGS = {'O': 0, 'PER': 1, 'LOC': 2, 'ORG': 3, 'MISC': 4}
+START = 5           #Row of the sentence starts in the HMM transition counts
+FLUSH_SIZE = 1 << 20
+
+
+def countsHMM(records, vocab = None):
+    """
+    The function counts a stream of training records in a single pass.
+    It returns the vocabulary index {word: id} (words not in [vocab] get
+    the next ids), a (vocab x 5) array with the frequencies of all
+    tag|word combinations and a (6 x 5) array with the tag transition
+    frequencies, whose last row counts the tags starting a sentence.
+    """
+    if vocab is None:
+        vocab = {}
+    emitCounts = np.zeros((len(vocab), 5), np.int64)
+    transCounts = np.zeros(6 * 5, np.int64)
+    wordIds = []; pairIds = []
+
+    def flush():
+        nonlocal emitCounts, transCounts
+        if not wordIds:
+            return
+        pairs = (np.array(wordIds, np.int64) * 5
+        + np.array(pairIds[0::2], np.int64))
+        counts = np.bincount(pairs, minlength = len(vocab) * 5)
+        counts = counts.reshape(len(vocab), 5)
+        counts[:len(emitCounts)] += emitCounts
+        emitCounts = counts
+        transCounts += np.bincount(np.array(pairIds[1::2], np.int64),
+        minlength = 6 * 5)
+        wordIds.clear(); pairIds.clear()
+
+    for tokens, _, tags in records:
+        preTag = START
+        for token, tag in zip(tokens, tags):
+            tag = TAGS['O'] if tag[:1] == 'O' else TAGS[tag[2:]]
+            wordIds.append(vocab.setdefault(token, len(vocab)))
+            pairIds.extend((tag, preTag * 5 + tag))
+            preTag = tag
+        if len(wordIds) >= FLUSH_SIZE:
+            flush()
+
+    flush()
+    return vocab, emitCounts, transCounts.reshape(6, 5)
+
+
+class FeatureMap:
+
+    """
+    Interns feature strings into dense integer ids. Id 0 is the bias
+    feature present in every instance and id 1 stands for every feature
+    unseen in training, so its weights stay zero.
+    """
+
+    def __init__(self, names = (BIAS, UNSEEN)):
+
+        self._idx = {name: i for i, name in enumerate(names)}
+
+
+    def __len__(self):
+        return len(self._idx)
+
+
+    def intern(self, name):
+        """
+        Returns the id of feature [name], adding it if it is new.
+        """
+        return self._idx.setdefault(name, len(self._idx))
+
+
+    def lookup(self, name):
+        """
+        Returns the id of feature [name], or the unseen id.
+        """
+        return self._idx.get(name, 1)
+
+
+    def names(self):
+        """
+        Returns the list of feature names, ordered by id.
+        """
+        return list(self._idx)
+
+
+def templateIds(values, idFn):
+    """
+    Returns the feature ids (bias first) of the MEMM templates filled
+    with [values] = <preToken, preNE, curToken, curPOS>, using [idFn]
+    (FeatureMap.intern or FeatureMap.lookup) to map names to ids.
+    """
+    return [0] + [idFn(template + value)
+    for template, value in zip(TEMPLATES, values)]
+
+
+def sentenceIds(tokens, POStags, featureMap):
+    """
+    Returns a (tokens x 3) array with the <preToken, curToken, curPOS>
+    feature ids of a sentence for decoding with the MEMM.
+    """
+    preTemplate, _, curTemplate, POStemplate = TEMPLATES
+    lookup = featureMap.lookup
+    ids = [(lookup(preTemplate + pre), lookup(curTemplate + token),
+    lookup(POStemplate + POS))
+    for pre, token, POS in zip([PRETOKEN] + tokens[:-1], tokens, POStags)]
+    return np.array(ids, np.int64).reshape(-1, 3)
 
 
-def baselineDict(filepath):
-    """
-    The function reads a test corpus and processes it into a dictionary
-    that contains all tokens and their NER tag (only the last one).
-    """
-    lines = readFile(filepath)
-    lineNum = 1
-    dict = {}
-
-    for line in lines:
-        if (lineNum % 3) == 1:
-            #Line contains tokens
-            tokens = line.strip().split()
-        elif (lineNum % 3) == 0:
-            #Line contains BIO tags
-            tags = line.strip().split()
-            assert len(tokens) == len(tags)
-            for i in range(len(tokens)):
-                dict[tokens[i]] = tags[i]
-        lineNum += 1
-
-    return dict
-
-
-def tagDictHMM(filepath):
-    """
-    The function reads a test corpus and processes it into a nested dictionary
-    that contains frequencies of all tag|word combinations.
-    """
-    lines = readFile(filepath)
-    lineNum = 1
-    dict = {'O':{}, 'PER':{}, 'LOC':{}, 'ORG':{}, 'MISC':{}}
-    vocab = {}
-
-    for line in lines:
-        if (lineNum % 3) == 1:
-            tokens = line.strip().split()
-            for token in tokens:
-                if token not in vocab:
-                    vocab[token] = 1
-                else:
-                    vocab[token] += 1
-        elif (lineNum % 3) == 0:
-            tags = line.strip().split()
-            for i in range(len(tokens)):
-                if tags[i][:1] == 'O':
-                    tagNE = 'O'
-                else:
-                    tagNE = tags[i][2:]
-                token = tokens[i]
-                if token not in dict[tagNE]:
-                    dict[tagNE][token] = 1
-                else:
-                    dict[tagNE][token] += 1
-        lineNum += 1
-    return dict, vocab
-
-
-def MEMMpreprocess(train):
-    """
-    Preprocessing function for the MEMM model. Returns a list of
-    tuples which contains the feature set (dictionary) and the
-    labled class.
-    """
-    #Feature set Format:
-    #<preToken, preNE, curToken, curPOS>
-    lines = readFile(train)
-    lineNum = 1
-    corpus = []
-
-    for line in lines:
-        if (lineNum % 3) == 1:
-            tokens = line.strip().split()
-            tokens.insert(0, PRETOKEN)
-
-        elif (lineNum % 3) == 2:
-            POStags = line.strip().split()
-
-        else:   #Third line with BIO tags
-            NEtags = line.strip().split()
-            NEtags.insert(0, PRENE)
-
-            for i in range(len(NEtags)):
-                if NEtags[i][:1] != 'O' and NEtags[i] != PRENE:
-                    NEtags[i] = NEtags[i][2:]
-
-            for i in range(1, len(tokens)):
-                features = {tokens[i-1]: True, NEtags[i-1]: True,
-                tokens[i]: True, POStags[i-1]: True}
-                corpus.append((features, NEtags[i]))
-
-        lineNum += 1
-    return corpus
+def MEMMfeatures(records, featureMap, grow = True):
+    """
+    Preprocessing function for the MEMM model. Returns a (tokens x 5)
+    array of the feature ids of every training token (a CSR matrix with
+    a fixed row width) and an array with the ids of their labled class.
+    New features are interned into [featureMap], or mapped to the unseen
+    id if not [grow].
+    """
+    ids = []; labels = []
+    idFn = featureMap.intern if grow else featureMap.lookup
+
+    for tokens, POStags, NEtags in records:
+        preToken = PRETOKEN; preNE = PRENE
+        for token, POS, NE in zip(tokens, POStags, NEtags):
+            if NE[:1] != 'O':
+                NE = NE[2:]
+            ids.extend(templateIds((preToken, preNE, token, POS), idFn))
+            labels.append(TAGS[NE])
+            preToken = token; preNE = NE
+
+    return np.array(ids).reshape(-1, 5), np.array(labels)
+
+
+def readCorpus(filepath):
+    """
+    A generator that lazily reads a 3-line corpus and yields one
+    (tokens, POS tags, BIO tags or indexes) record at a time, each field
+    as a list of strings. Blank lines between and after records are
+    skipped. Raises ValueError on an incomplete record or on lines of
+    different lengths.
+    """
+    #(line number, line) of the non-blank lines
+    lines = ((lineNum, line) for lineNum, line
+    in enumerate(readFile(filepath), 1) if line.strip())
+
+    for first in lines:
+        record = [first, next(lines, None), next(lines, None)]
+        if record[2] is None:
+            lineNum = (record[1] or first)[0]
+            raise ValueError("%s: incomplete record ending at line %d"
+            % (filepath, lineNum))
+
+        tokens, POStags, tags = [line.split() for _, line in record]
+        if not len(tokens) == len(POStags) == len(tags):
+            raise ValueError("%s: lines %d-%d have different lengths"
+            % (filepath, first[0], record[2][0]))
+        yield tokens, POStags, tags
+
+
+def iterRecords(corpus):
+    """
+    The function returns an iterator over the records of [corpus], which
+    is either the path of a 3-line corpus (read lazily, see [readCorpus])
+    or a list of records already parsed with [asRecords].
+    """
+    if isinstance(corpus, str):
+        return readCorpus(corpus)
+    return iter(corpus)
+
+
+def asRecords(corpus):
+    """
+    The function parses [corpus] (a path or records, see [iterRecords])
+    into a list of records that can be shared by several models.
+    """
+    if isinstance(corpus, list):
+        return corpus
+    return list(iterRecords(corpus))
 
 
 def readFile(filepath):
 
 	"""
-	Reads a text file and returns a list of paragraphs
+	Lazily reads a text file and yields its lines one at a time
 
 	Input
 	------
@@ -115,27 +202,37 @@ def readFile(filepath):
 
 	Output
 	-------
-	text: a list of the sentences in the text file
+	text: a generator over the lines in the text file
 	"""
 
 	with open(filepath, "r", encoding = "utf-8") as fp:
-		text = fp.readlines()
-	fp.close()
-	return text
+		yield from fp
+
+
+def packStrings(strings):
+    """
+    Packs a list of whitespace-free strings (tokens, feature names) into
+    a single utf-8 byte array for compact storage in .npz/.npy files.
+    """
+    return np.frombuffer('\n'.join(strings).encode('utf-8'), np.uint8)
+
+
+def unpackStrings(packed):
+    """
+    Inverse of [packStrings]; returns the list of strings.
+    """
+    if len(packed) == 0:
+        return []
+    return bytes(packed).decode('utf-8').split('\n')
 
 
 def extractTags(exTo, exFrom = "Project2_fall2018/train.txt"):
     """
     Extracts the NE tags from train.txt to a new file.
     """
-    lines = readFile(exFrom)
-    lineNum = 1
     with open(exTo, "w", encoding = "utf-8") as f:
-        for line in lines:
-            if (lineNum % 3) == 0:
-                f.write(line)
-            lineNum += 1
-    f.close()
+        for _, _, tags in readCorpus(exFrom):
+            f.write('\t'.join(tags) + '\n')
 
 
 def main():